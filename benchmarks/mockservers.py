@@ -0,0 +1,220 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class MockBehaviour:
+    """
+    How a stand-in server misbehaves: response latency, a share of 500s, and
+    429s with a Retry-After header once more than rate_limit requests arrive
+    within one second
+    """
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        error_rate: float = 0.0,
+        rate_limit: Optional[int] = None,
+        retry_after: float = 1.0,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.counts = {"requests": 0, "errors": 0, "throttled": 0}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._window_count = 0
+
+    def outcome(self) -> Optional[int]:
+        """
+        Sleep for the simulated latency and return an error status to send, if any
+        """
+        with self._lock:
+            self.counts["requests"] += 1
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            throttled = self.rate_limit is not None and self._window_count > self.rate_limit
+            failed = not throttled and self._random.random() < self.error_rate
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter))
+            if throttled:
+                self.counts["throttled"] += 1
+            elif failed:
+                self.counts["errors"] += 1
+
+        if throttled:
+            return 429
+        time.sleep(delay)
+        return 500 if failed else None
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def fake_serp(query: str, email_rate: float = 0.5) -> Dict:
+    """
+    Deterministic SerpAPI-shaped response; about email_rate of the queries
+    mention a single contact email the fast path can pick up
+    """
+    slug = re.sub(r"[^a-z0-9]+", "", query.lower())[:20] or "company"
+    organic = [
+        {
+            "position": position + 1,
+            "title": f"{query} - result {position + 1}",
+            "link": f"https://{slug}.com/page{position}",
+            "snippet": f"Everything about {query}. " * 4
+        }
+        for position in range(10)
+    ]
+    if _digest(query) % 1000 < email_rate * 1000:
+        organic[0]["snippet"] += f" Contact us at info@{slug}.com."
+    return {
+        "search_metadata": {"status": "Success"},
+        "search_parameters": {"q": query, "engine": "google"},
+        "organic_results": organic
+    }
+
+
+def _chat_answer(prompt: str) -> str:
+    """
+    Answer a batched extraction prompt with one entry per company id
+    """
+    results = []
+    for line in prompt.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict) and "id" in entry:
+            slug = re.sub(r"[^a-z0-9]+", "", str(entry.get("company", "")).lower())[:20]
+            results.append({"id": entry["id"], "extracted_data": f"contact@{slug}.com"})
+    return json.dumps({"results": results})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: Optional[Dict] = None, headers: Optional[Dict] = None):
+        body = json.dumps(payload or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self, status: int):
+        if status == 429:
+            self._send(429, {"error": {"message": "Rate limit reached"}},
+                       {"Retry-After": f"{self.server.behaviour.retry_after:g}"})
+        else:
+            self._send(status, {"error": {"message": "Simulated server error"}})
+
+
+class SerpHandler(_Handler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/search":
+            return self._send(404)
+        status = self.server.behaviour.outcome()
+        if status:
+            return self._fail(status)
+        query = parse_qs(url.query).get("q", [""])[0]
+        self._send(200, fake_serp(query, self.server.email_rate))
+
+
+class OpenAIHandler(_Handler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        status = self.server.behaviour.outcome()
+        if status:
+            return self._fail(status)
+
+        usage = {"prompt_tokens": 0, "completion_tokens": 10, "total_tokens": 10}
+        if self.path.endswith("/chat/completions"):
+            prompt = request["messages"][-1]["content"]
+            self._send(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": _chat_answer(prompt)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+        elif self.path.endswith("/completions"):
+            company = re.search(r"company '([^']*)'", request.get("prompt", ""))
+            slug = re.sub(r"[^a-z0-9]+", "", (company.group(1) if company else "").lower())[:20]
+            self._send(200, {
+                "id": "cmpl-mock",
+                "object": "text_completion",
+                "choices": [{"index": 0, "text": f" contact@{slug}.com", "finish_reason": "stop"}],
+                "usage": usage
+            })
+        else:
+            self._send(404)
+
+
+class _Server(ThreadingHTTPServer):
+    # The default backlog of 5 drops concurrent connects, adding 1s SYN retries to the latencies
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class MockServer:
+    """
+    Runs a stand-in server on a free local port in a background thread
+    """
+    def __init__(self, handler, behaviour: Optional[MockBehaviour] = None, **attributes):
+        self.behaviour = behaviour or MockBehaviour()
+        self._server = _Server(("127.0.0.1", 0), handler)
+        self._server.behaviour = self.behaviour
+        for name, value in attributes.items():
+            setattr(self._server, name, value)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "MockServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def serp_server(behaviour: Optional[MockBehaviour] = None, email_rate: float = 0.5) -> MockServer:
+    """
+    Stand-in for SerpAPI, serving GET /search
+    """
+    return MockServer(SerpHandler, behaviour, email_rate=email_rate)
+
+
+def openai_server(behaviour: Optional[MockBehaviour] = None) -> MockServer:
+    """
+    Stand-in for the OpenAI completion and chat completion endpoints, under /v1
+    """
+    return MockServer(OpenAIHandler, behaviour)
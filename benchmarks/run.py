@@ -0,0 +1,359 @@
+"""
+Offline throughput benchmarks for Fetchify.
+
+Starts local stand-ins for SerpAPI and OpenAI, points the components at them
+and reports rows/sec, per-call latency percentiles and peak traced memory for
+each scenario at every dataset size. Run from the repository root:
+
+    python -m benchmarks.run --sizes 100,1000 --latency 0.05 --error-rate 0.01
+
+process_and_store_extracted_data needs PostgreSQL and only runs with
+--pg-dsn. It inserts bench-* rows into filtered_db and removes them again,
+but it extracts every pending row in the table, so use a scratch database.
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.mockservers import MockBehaviour, fake_serp, openai_server, serp_server
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+@contextlib.contextmanager
+def timed_calls(owner, attribute: str, samples: List[float]):
+    """
+    Record the duration of every call to owner.attribute while the block runs
+    """
+    original = getattr(owner, attribute)
+
+    if asyncio.iscoroutinefunction(original):
+        @functools.wraps(original)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+    else:
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+
+    setattr(owner, attribute, wrapper)
+    try:
+        yield
+    finally:
+        setattr(owner, attribute, original)
+
+
+def measure(scenario: str, size: int, run: Callable[[List[float]], Dict], trace_memory: bool) -> Dict:
+    """
+    Time run(samples), which fills samples with per-call latencies and
+    returns extra figures to report
+    """
+    samples: List[float] = []
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        extra = run(samples) or {}
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    return {
+        "scenario": scenario,
+        "rows": size,
+        "seconds": elapsed,
+        "rows_per_sec": size / elapsed if elapsed else None,
+        "calls": len(samples),
+        "p50_ms": _ms(percentile(samples, 50)),
+        "p95_ms": _ms(percentile(samples, 95)),
+        "p99_ms": _ms(percentile(samples, 99)),
+        "peak_mb": peak / 2**20 if peak is not None else None,
+        **extra
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return seconds * 1000 if seconds is not None else None
+
+
+def bench_rate_limiter(size: int, args) -> Callable:
+    from components.ratelimiting import RateLimiter
+
+    def run(samples: List[float]) -> Dict:
+        # Pure bookkeeping cost, the limits are never reached
+        limiter = RateLimiter(max_per_second=10**9, max_per_day=10**12)
+        with timed_calls(limiter, "try_acquire", samples):
+            for _ in range(size):
+                limiter.try_acquire()
+        return {}
+
+    def run_paced(samples: List[float]) -> Dict:
+        # How closely a blocking caller tracks the configured rate
+        limiter = RateLimiter(max_per_second=args.limiter_rate, max_per_day=10**12)
+        with timed_calls(limiter, "wait_if_needed", samples):
+            for _ in range(size):
+                limiter.wait_if_needed()
+        return {"target_per_sec": args.limiter_rate}
+
+    return run, run_paced
+
+
+def bench_scrapetheweb(size: int, args, use_async: bool) -> Callable:
+    import pandas as pd
+    from components import scraper
+    from components.ratelimiting import RateLimiter
+
+    df = pd.DataFrame({"company": [f"Company {i}" for i in range(size)]})
+
+    def run(samples: List[float]) -> Dict:
+        limiter = RateLimiter(max_per_second=args.serp_rate, max_per_day=10**12)
+        method = "search_async" if use_async else "search"
+        with timed_calls(scraper.SerpClient, method, samples):
+            output = scraper.scrapetheweb(
+                "{value} contact email",
+                "company",
+                df,
+                export_format=None,
+                db_name=None,
+                use_async=use_async,
+                max_concurrency=args.concurrency,
+                progress_callback=lambda done, total: None,
+                rate_limit_state=None,
+                jobs_db=None,
+                rate_limiter=limiter,
+                fingerprints_db=None
+            )
+        return {"failed": sum(result is None for result in output["results"])}
+
+    return run
+
+
+def bench_extract(size: int, args) -> Callable:
+    from components import llm
+
+    records = [(i, f"Company {i}", fake_serp(f"Company {i} contact email")) for i in range(size)]
+
+    def run(samples: List[float]) -> Dict:
+        with timed_calls(llm.openai.Completion, "create", samples):
+            answers = [llm.extract_relevant_data(name, results) for _, name, results in records]
+        return {"failed": sum(answer is None for answer in answers)}
+
+    def run_batched(samples: List[float]) -> Dict:
+        with timed_calls(llm, "extract_relevant_data_batch", samples):
+            extracted = llm.extract_records(records, batch_size=args.batch_size)
+        return {
+            "failed": sum(value is None for value, _ in extracted.values()),
+            "fastpath": sum(resolved_by == "fastpath" for _, resolved_by in extracted.values())
+        }
+
+    def run_concurrent(samples: List[float]) -> Dict:
+        first_row = None
+
+        async def consume():
+            nonlocal first_row
+            start = time.perf_counter()
+            extractor = llm.AsyncExtractor(args.llm_concurrency)
+            answers = {}
+            async for record_id, value in extractor.stream(records):
+                if first_row is None:
+                    first_row = time.perf_counter() - start
+                answers[record_id] = value
+            return answers
+
+        with timed_calls(llm.openai.Completion, "acreate", samples):
+            answers = asyncio.run(consume())
+        return {
+            "failed": sum(answer is None for answer in answers.values()),
+            "first_row_ms": _ms(first_row)
+        }
+
+    return run, run_batched, run_concurrent
+
+
+def bench_process_and_store(size: int, args) -> Callable:
+    from components import llm
+    from components.db import get_connection
+    from components.storeresults import ensure_schema, ingest_search_results
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+
+    def run(samples: List[float]) -> Dict:
+        with get_connection() as connection:
+            ensure_schema(connection)
+            ingest_search_results(
+                connection,
+                ((f"{prefix}-{i}", fake_serp(f"Company {i} contact email")) for i in range(size))
+            )
+        try:
+            with timed_calls(llm, "extract_records", samples):
+                llm.process_and_store_extracted_data(batch_size=args.batch_size, cache_db=None)
+            with get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "SELECT COUNT(*) FROM filtered_db WHERE company_name LIKE %s AND extracted_data IS NULL",
+                    (f"{prefix}-%",)
+                )
+                failed = cursor.fetchone()[0]
+                cursor.close()
+        finally:
+            with get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("DELETE FROM filtered_db WHERE company_name LIKE %s", (f"{prefix}-%",))
+                connection.commit()
+                cursor.close()
+        return {"failed": failed}
+
+    return run
+
+
+def use_pg_dsn(dsn: str):
+    """
+    Point components.db at the given database through the PG* variables it reads
+    """
+    from psycopg2.extensions import parse_dsn
+
+    names = {"dbname": "PGDATABASE", "user": "PGUSER", "password": "PGPASSWORD", "host": "PGHOST", "port": "PGPORT"}
+    for key, value in parse_dsn(dsn).items():
+        if key in names:
+            os.environ[names[key]] = value
+
+
+def print_report(rows: List[Dict]):
+    columns = ["scenario", "rows", "rows_per_sec", "p50_ms", "p95_ms", "p99_ms", "peak_mb", "failed"]
+    table = [[_cell(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in table)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def _cell(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:,.1f}" if value >= 10 else f"{value:.2f}"
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Fetchify benchmarks against local stand-in servers")
+    parser.add_argument("--sizes", default="100,1000", help="Comma separated dataset sizes")
+    parser.add_argument("--scenarios", default="limiter,serp,llm,store",
+                        help="Any of limiter, serp, llm and store (store needs --pg-dsn)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument("--server-rate-limit", type=int, default=None,
+                        help="Requests per second a stand-in accepts before answering 429")
+    parser.add_argument("--email-rate", type=float, default=0.5,
+                        help="Share of SERP responses with an email the fast path can resolve")
+    parser.add_argument("--serp-rate", type=float, default=1000, help="Client-side SerpAPI requests per second")
+    parser.add_argument("--limiter-rate", type=float, default=500, help="Rate for the paced RateLimiter scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="In-flight SerpAPI requests in async mode")
+    parser.add_argument("--batch-size", type=int, default=20, help="Companies per batched LLM request")
+    parser.add_argument("--llm-concurrency", type=int, default=50, help="In-flight requests for AsyncExtractor")
+    parser.add_argument("--pg-dsn", default=None, help="PostgreSQL DSN of a scratch database")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip tracemalloc, which slows allocation-heavy code down")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show component logs and prints")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    scenarios = set(args.scenarios.split(","))
+    trace_memory = not args.no_memory
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    def behaviour(seed: int) -> MockBehaviour:
+        return MockBehaviour(args.latency, args.jitter, args.error_rate, args.server_rate_limit, seed=seed)
+
+    serp_mock = serp_server(behaviour(1), args.email_rate)
+    openai_mock = openai_server(behaviour(2))
+    report = []
+
+    with serp_mock, openai_mock, tempfile.TemporaryDirectory() as workdir:
+        os.environ["SERP_API_URL"] = f"{serp_mock.url}/search"
+        os.environ.setdefault("SERP_API_KEY", "benchmark")
+        os.environ["OPENAI_API_BASE"] = f"{openai_mock.url}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        if args.pg_dsn:
+            use_pg_dsn(args.pg_dsn)
+
+        import openai
+        from components import scraper
+        openai.api_base = os.environ["OPENAI_API_BASE"]
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        scraper.SERP_API_URL = os.environ["SERP_API_URL"]
+
+        # Components write their caches and logs to the working directory
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        try:
+            for size in sizes:
+                runs = []
+                if "limiter" in scenarios:
+                    overhead, paced = bench_rate_limiter(size, args)
+                    runs += [("ratelimiter.try_acquire", overhead), ("ratelimiter.wait_if_needed", paced)]
+                if "serp" in scenarios:
+                    runs += [
+                        ("scrapetheweb.sync", bench_scrapetheweb(size, args, use_async=False)),
+                        ("scrapetheweb.async", bench_scrapetheweb(size, args, use_async=True))
+                    ]
+                if "llm" in scenarios:
+                    single, batched, concurrent = bench_extract(size, args)
+                    runs += [
+                        ("extract_relevant_data", single),
+                        ("extract_records.batched", batched),
+                        ("AsyncExtractor.stream", concurrent)
+                    ]
+                if "store" in scenarios and args.pg_dsn:
+                    runs.append(("process_and_store_extracted_data", bench_process_and_store(size, args)))
+
+                for name, run in runs:
+                    with quiet:
+                        report.append(measure(name, size, run, trace_memory))
+        finally:
+            os.chdir(cwd)
+
+        servers = {"serp": serp_mock.behaviour.counts, "openai": openai_mock.behaviour.counts}
+
+    print_report(report)
+    print(f"\nStand-in requests: {json.dumps(servers)}")
+    if "store" in scenarios and not args.pg_dsn:
+        print("Skipped process_and_store_extracted_data: pass --pg-dsn to run it")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": report, "servers": servers}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
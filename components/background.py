@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+
+from components.cache import ResponseCache
+from components.fastpath import resolve_fast_path
+from components.llm import AsyncExtractor
+from components.scraper import scrapetheweb
+
+logger = logging.getLogger(__name__)
+
+
+class JobHandle:
+    """
+    Progress and partial results of a background job, readable from any session
+    """
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = "queued"
+        self.searched = 0
+        self.total = 0
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.future = None
+        self.export_files: List[str] = []
+        self.reused_rows = 0
+        self.error_count = 0
+        self.errors: List[str] = []
+        self._rows: List[Dict] = []
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def row_count(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def set_progress(self, searched: int, total: int):
+        self.searched = searched
+        self.total = total
+
+    def add_row(self, row: Dict):
+        with self._lock:
+            self._rows.append(row)
+
+    def add_error(self, query: str, err: Exception, keep: int = 100):
+        """
+        Record a query that could not be searched; only the first keep
+        messages are kept, the rest are counted
+        """
+        with self._lock:
+            self.error_count += 1
+            if len(self.errors) < keep:
+                self.errors.append(f"{query}: {err}")
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+        """
+        Copy of the completed rows from start (in completion order)
+        """
+        with self._lock:
+            return self._rows[start:stop]
+
+
+class JobRunner:
+    """
+    Runs jobs on a thread pool shared by every session, keyed by job id.
+
+    Jobs outlive the Streamlit script run that started them, so widget
+    interactions and reruns only change what the page shows.
+    """
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="fetchify-job")
+        self._jobs: Dict[str, JobHandle] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id: str, func: Callable[..., Any], *args, **kwargs) -> JobHandle:
+        """
+        Start func(handle, *args, **kwargs) in the background, unless a job
+        with this id is already running, in which case that job is returned
+        """
+        with self._lock:
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.running:
+                return existing
+            handle = JobHandle(job_id)
+            self._jobs[job_id] = handle
+        handle.future = self._executor.submit(self._run, handle, func, args, kwargs)
+        return handle
+
+    def _run(self, handle: JobHandle, func: Callable[..., Any], args: tuple, kwargs: dict):
+        handle.status = "running"
+        handle.started_at = time()
+        try:
+            handle.result = func(handle, *args, **kwargs)
+            handle.status = "done"
+        except Exception as e:
+            logger.exception(f"Background job {handle.job_id} failed")
+            handle.error = e
+            handle.status = "failed"
+        finally:
+            handle.finished_at = time()
+
+    def get(self, job_id: str) -> Optional[JobHandle]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    """
+    One runner per process, shared across sessions and reruns
+    """
+    return JobRunner()
+
+
+def run_fetch_job(
+    handle: JobHandle,
+    query_template: str,
+    column_name: str,
+    df: pd.DataFrame,
+    openai_api_key: Optional[str] = None,
+    extract_concurrency: int = 50,
+    export_format: Optional[str] = "excel",
+    missing_values: str = "skip",
+    retry_failed: bool = False
+) -> pd.DataFrame:
+    """
+    Search every distinct value of the column and extract its email address.
+
+    The regex fast path is tried first and the LLM only for the rest, through
+    an AsyncExtractor paced by the process's shared OpenAI limits. Each row is
+    added to the handle as soon as its extraction finishes, so the page can
+    show partial results while the search is still running. Rows unchanged
+    since an earlier run reuse its search results, and their extraction is
+    answered by the fast path or the LLM cache. With retry_failed, queries
+    that failed in an earlier run of the job are fetched again. Search errors
+    are recorded on the handle.
+    """
+    llm_cache = ResponseCache("llm_cache.db", table="llm_cache", ttl=None)
+    # The LLM requests run on their own event loop, fed while the search runs
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True, name=f"extract-{handle.job_id}")
+    loop_thread.start()
+    records: asyncio.Queue = asyncio.Queue()
+
+    async def pending_records():
+        while (record := await records.get()) is not None:
+            yield record
+
+    async def extract_all():
+        # The session's own key, never another session's or the process-wide one
+        extractor = AsyncExtractor(extract_concurrency, cache=llm_cache, api_key=openai_api_key)
+        async for value, email in extractor.stream(pending_records()):
+            handle.add_row({"Entity": value, "Email": email, "Resolved by": "llm" if email else None})
+
+    extraction = asyncio.run_coroutine_threadsafe(extract_all(), loop)
+
+    def on_result(value: str, result: Optional[Dict]):
+        email = resolve_fast_path(value, result) if result is not None else None
+        if email is not None:
+            handle.add_row({"Entity": value, "Email": email, "Resolved by": "fastpath"})
+        elif result is not None and openai_api_key:
+            loop.call_soon_threadsafe(records.put_nowait, (value, value, result))
+        else:
+            handle.add_row({"Entity": value, "Email": None, "Resolved by": None})
+
+    try:
+        output = scrapetheweb(
+            query_template,
+            column_name,
+            df,
+            export_format=export_format,
+            missing_values=missing_values,
+            retry_failed=retry_failed,
+            # Rows reach the handle through on_result, nothing else needs the responses
+            collect_results=False,
+            use_async=True,
+            job_id=handle.job_id,
+            progress_callback=handle.set_progress,
+            result_callback=on_result,
+            # st.error would be dropped on this thread, the page shows these instead
+            error_callback=lambda err, query: handle.add_error(query, err)
+        )
+        handle.export_files = output["export_files"]
+        handle.reused_rows = output["reused_rows"]
+        loop.call_soon_threadsafe(records.put_nowait, None)
+        extraction.result()
+    finally:
+        extraction.cancel()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+        llm_cache.close()
+
+    return pd.DataFrame(handle.rows())
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from time import time
+from typing import Any, Dict, Optional
+
+from components.metrics import CACHE_LOOKUPS
+
+
+def normalize_query(query: str) -> str:
+    """
+    Collapse whitespace and case so trivially different queries share an entry
+    """
+    return " ".join(str(query).split()).casefold()
+
+
+def serp_cache_key(query: str, engine: str, num: int, gl: str) -> str:
+    """
+    Build the cache key for a SerpAPI request from the final query and engine parameters
+    """
+    payload = json.dumps(
+        {"q": normalize_query(query), "engine": engine, "num": num, "gl": gl},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def llm_cache_key(model: str, prompt_template: str, entity: str, search_results) -> str:
+    """
+    Content-addressed key for an LLM extraction: the same model, prompt and
+    condensed search results for the same entity always map to the same entry
+    """
+    payload = json.dumps(
+        {
+            "model": model,
+            "prompt_template": prompt_template,
+            "entity": normalize_query(entity),
+            "search_results": search_results
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache for JSON responses with a TTL and LRU eviction
+    """
+    def __init__(
+        self,
+        db_name: str = 'search_results.db',
+        table: str = 'serp_cache',
+        ttl: Optional[float] = 7 * 86400,
+        max_entries: Optional[int] = 100_000
+    ):
+        self.db_name = db_name
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_name, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+        """)
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_last_accessed ON {table} (last_accessed)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value for key, or None on a miss or expired entry
+        """
+        now = time()
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.table, result="miss")
+                return None
+
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._connection.commit()
+                self._size -= 1
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.table, result="miss")
+                return None
+
+            self._connection.execute(
+                f"UPDATE {self.table} SET last_accessed = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache=self.table, result="hit")
+            return json.loads(value)
+
+    def set(self, key: str, value: Any):
+        """
+        Store value under key, evicting the least recently used entries past max_entries
+        """
+        now = time()
+        payload = json.dumps(value)
+        with self._lock:
+            cursor = self._connection.execute(
+                f"INSERT OR IGNORE INTO {self.table} (key, value, created_at, last_accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, payload, now, now)
+            )
+            if cursor.rowcount == 1:
+                self._size += 1
+            else:
+                self._connection.execute(
+                    f"UPDATE {self.table} SET value = ?, created_at = ?, last_accessed = ? "
+                    "WHERE key = ?",
+                    (payload, now, now, key)
+                )
+
+            if self.max_entries is not None and self._size > self.max_entries:
+                overflow = self._size - self.max_entries
+                self._connection.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY last_accessed LIMIT ?)",
+                    (overflow,)
+                )
+                self._size -= overflow
+                self.evictions += overflow
+
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss counters for reporting
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._size
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.table}")
+            self._connection.commit()
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
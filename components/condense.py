@@ -0,0 +1,119 @@
+import json
+import re
+from typing import Dict, Iterator, List
+
+from components.tokens import count_tokens
+
+# Knowledge-graph / local-result fields worth keeping for contact extraction
+CONTACT_FIELDS = ("title", "type", "website", "email", "phone", "address", "contact", "headquarters")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CONTACT_HINT_RE = re.compile(r"@|\bcontact\b|\bemail\b|\bphone\b|\btel\b", re.IGNORECASE)
+
+
+def _words(text: str) -> set:
+    return set(_WORD_RE.findall(text.lower()))
+
+
+def _iter_entries(search_results) -> Iterator[Dict]:
+    """
+    Yield the title/snippet/link entries of a SerpAPI payload, skipping ads,
+    metadata and pagination
+    """
+    if isinstance(search_results, list):
+        for item in search_results:
+            yield from _iter_entries(item)
+        return
+    if not isinstance(search_results, dict):
+        return
+
+    answer_box = search_results.get("answer_box")
+    if isinstance(answer_box, dict):
+        yield {
+            "title": answer_box.get("title"),
+            "snippet": answer_box.get("answer") or answer_box.get("snippet"),
+            "link": answer_box.get("link")
+        }
+
+    local_results = search_results.get("local_results")
+    if isinstance(local_results, dict):
+        for place in local_results.get("places", []):
+            yield {
+                "title": place.get("title"),
+                "snippet": " ".join(str(place[f]) for f in ("address", "phone") if place.get(f)),
+                "link": place.get("website") or place.get("links", {}).get("website")
+            }
+
+    for result in search_results.get("organic_results", []):
+        yield {
+            "title": result.get("title"),
+            "snippet": result.get("snippet"),
+            "link": result.get("link")
+        }
+
+    # Bare {"snippet": ..., "link": ...} payloads, as stored by storeresults.py
+    if "snippet" in search_results or "link" in search_results:
+        yield {
+            "title": search_results.get("title"),
+            "snippet": search_results.get("snippet"),
+            "link": search_results.get("link")
+        }
+
+
+def condense_search_results(
+    entity: str,
+    search_results,
+    max_tokens: int = 1000,
+    model: str = "gpt-3.5-turbo"
+) -> Dict:
+    """
+    Reduce a raw SerpAPI payload to the fields useful for extraction.
+
+    Keeps knowledge-graph contact fields plus organic/answer/local snippets,
+    drops repeated snippets, ranks the rest by word overlap with the entity
+    (contact-looking snippets first among equals) and stops once max_tokens
+    would be exceeded.
+    """
+    if isinstance(search_results, str):
+        try:
+            search_results = json.loads(search_results)
+        except ValueError:
+            search_results = {"snippet": search_results}
+
+    condensed: Dict = {}
+    knowledge_graph = search_results.get("knowledge_graph") if isinstance(search_results, dict) else None
+    if isinstance(knowledge_graph, dict):
+        fields = {field: knowledge_graph[field] for field in CONTACT_FIELDS if knowledge_graph.get(field)}
+        if fields:
+            condensed["knowledge_graph"] = fields
+
+    entries: List[Dict] = []
+    seen = set()
+    for entry in _iter_entries(search_results):
+        entry = {key: value for key, value in entry.items() if value}
+        text = " ".join(str(entry.get("snippet") or entry.get("title") or "").split()).lower()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        entries.append(entry)
+
+    entity_words = _words(entity)
+
+    def relevance(entry: Dict) -> tuple:
+        text = " ".join(str(value) for value in entry.values())
+        return (len(entity_words & _words(text)), bool(_CONTACT_HINT_RE.search(text)))
+
+    # sorted() is stable, so ties keep SerpAPI's own ranking
+    entries = sorted(entries, key=relevance, reverse=True)
+
+    used = count_tokens(json.dumps(condensed), model)
+    results = []
+    for entry in entries:
+        tokens = count_tokens(json.dumps(entry), model) + 1
+        if used + tokens > max_tokens:
+            break
+        results.append(entry)
+        used += tokens
+
+    condensed["results"] = results
+    return condensed
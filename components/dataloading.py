@@ -0,0 +1,102 @@
+import hashlib
+from typing import List, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from components.queryplan import normalize_column, plan_rendered_queries, render_queries
+
+
+def file_digest(uploaded_file) -> str:
+    """
+    Hash of the uploaded file's contents, computed once per upload
+    """
+    key = f"file_digest:{uploaded_file.file_id}"
+    if key not in st.session_state:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(uploaded_file.getbuffer())
+        st.session_state[key] = digest.hexdigest()
+    return st.session_state[key]
+
+
+def _rewind(uploaded_file):
+    # The upload is already an in-memory file, so it is read in place rather
+    # than copied; earlier reads leave it at the end, hence the seek
+    uploaded_file.seek(0)
+    return uploaded_file
+
+
+@st.cache_data(max_entries=16)
+def read_columns(digest: str, _uploaded_file) -> List[str]:
+    """
+    Column names only, without parsing any rows
+    """
+    return pd.read_csv(_rewind(_uploaded_file), nrows=0).columns.tolist()
+
+
+@st.cache_data(max_entries=16)
+def load_preview(digest: str, _uploaded_file, rows: int = 1000) -> pd.DataFrame:
+    """
+    The first rows of every column, for display
+    """
+    return pd.read_csv(_rewind(_uploaded_file), nrows=rows)
+
+
+# cache_resource hands back the same frame instead of unpickling a copy on
+# every rerun, which matters for large files; callers must not mutate it
+@st.cache_resource(max_entries=8)
+def load_columns(digest: str, columns: Tuple[str, ...], _uploaded_file) -> pd.DataFrame:
+    """
+    Parse only the given columns with the multithreaded pyarrow reader,
+    keeping Arrow dtypes for compact strings and inferred numbers
+    """
+    try:
+        return pd.read_csv(
+            _rewind(_uploaded_file),
+            engine="pyarrow",
+            usecols=list(columns),
+            dtype_backend="pyarrow"
+        )
+    except (pd.errors.EmptyDataError, KeyError):
+        raise
+    except Exception as e:
+        # pyarrow reports malformed CSVs with its own exception types
+        raise pd.errors.ParserError(str(e)) from e
+
+
+@st.cache_data(max_entries=16)
+def count_distinct_values(digest: str, column: str, _series: pd.Series) -> int:
+    """
+    Number of distinct values of a column once normalized, ignoring case;
+    blank and missing cells are not counted
+    """
+    return int(normalize_column(_series).str.lower().nunique())
+
+
+@st.cache_data(max_entries=16)
+def count_distinct_queries(
+    digest: str,
+    query_template: str,
+    column: str,
+    missing: str,
+    _frame: pd.DataFrame
+) -> int:
+    """
+    Number of searches a job over the frame would send: its distinct rendered
+    queries, planned the same way
+    """
+    first_rows, _ = plan_rendered_queries(render_queries(_frame, query_template, column, missing))
+    return len(first_rows)
+
+
+def show_paginated(frame, key: str, page_size: int = 1000):
+    """
+    Render one page of a frame or series at a time
+    """
+    pages = max((len(frame) - 1) // page_size + 1, 1)
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    start = (page - 1) * page_size
+    st.dataframe(frame.iloc[start:start + page_size], use_container_width=True)
+    st.caption(f"Rows {start + 1}–{min(start + page_size, len(frame))} of {len(frame)}")
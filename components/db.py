@@ -0,0 +1,109 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import streamlit as st
+
+
+def db_settings() -> dict:
+    """
+    PostgreSQL connection parameters, overridable with the standard PG* variables
+    """
+    return {
+        "dbname": os.getenv("PGDATABASE", "my_database"),
+        "user": os.getenv("PGUSER", "your_username"),
+        "password": os.getenv("PGPASSWORD", "your_password"),
+        "host": os.getenv("PGHOST", "localhost"),
+        "port": os.getenv("PGPORT", "5432"),
+    }
+
+
+class ConnectionPool:
+    """
+    Bounded, lazily filled pool of PostgreSQL connections.
+
+    Connections are only opened when first borrowed and are then kept for
+    reuse. Borrowers wait for a free slot instead of failing once maxconn
+    connections are in use, and idle connections are health-checked before
+    they are handed out again.
+    """
+    def __init__(self, maxconn: int = 10, **settings):
+        self.maxconn = maxconn
+        self.settings = settings
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def _healthy(self, connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    return psycopg2.connect(**self.settings)
+                # A server restart leaves dead connections behind, drop them
+                if self._healthy(connection):
+                    return connection
+                connection.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, close: bool = False):
+        try:
+            if not close and not connection.closed:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    close = True
+            if close or connection.closed:
+                connection.close()
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle.clear()
+
+
+@st.cache_resource
+def get_pool(maxconn: int = 10) -> ConnectionPool:
+    """
+    One pool per process, shared by every Streamlit session and script rerun
+    """
+    return ConnectionPool(maxconn, **db_settings())
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled connection for the duration of a with block
+    """
+    db_pool = get_pool()
+    connection = db_pool.getconn()
+    broken = False
+    try:
+        yield connection
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(connection, close=broken)
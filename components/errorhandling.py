@@ -1,10 +1,15 @@
+import hashlib
+import io
+import re
 import pandas as pd
+import requests
 import streamlit as st
 import logging
 import traceback
+from components.metrics import setup_logging
 
-# Configure logging
-logging.basicConfig(filename="fetchify_errors.log", level=logging.ERROR)
+# Configure logging; records are written from a background thread
+setup_logging("fetchify_errors.log", level=logging.ERROR)
 
 def handle_error(error, context=""):
     """
@@ -60,8 +65,12 @@ def fetchify_dashboard():
         google_sheet_url = st.text_input("Enter Google Sheet URL (optional)")
         if google_sheet_url:
             try:
-                # Assume connect_to_google_sheet is a function that fetches data from Google Sheets
-                data = connect_to_google_sheet(google_sheet_url)
+                # Refetched on every rerun, but only parsed again when the sheet changed
+                poll_state = st.session_state.setdefault(f"google_sheet:{google_sheet_url}", {})
+                sheet = connect_to_google_sheet(google_sheet_url, poll_state)
+                if sheet is not None:
+                    poll_state["data"] = sheet
+                data = poll_state["data"]
                 st.write("Google Sheets data loaded successfully!")
                 st.dataframe(data.head())
             except Exception as e:
@@ -85,10 +94,59 @@ def fetchify_dashboard():
         handle_error(e)
 
 # Define other utility functions
-def connect_to_google_sheet(sheet_url):
-    """ Placeholder function to simulate Google Sheets data retrieval. """
-    # Your connection and data retrieval logic here
-    pass
+def google_sheet_csv_url(sheet_url):
+    """ CSV export URL of a Google Sheets link, keeping the tab (gid) it points at. """
+    match = re.search(r"/spreadsheets/d/([a-zA-Z0-9_-]+)", sheet_url)
+    if match is None:
+        raise ValueError(f"Not a Google Sheets URL: {sheet_url}")
+    export_url = f"https://docs.google.com/spreadsheets/d/{match.group(1)}/export?format=csv"
+    gid = re.search(r"[#?&]gid=(\d+)", sheet_url)
+    if gid:
+        export_url += f"&gid={gid.group(1)}"
+    return export_url
+
+def connect_to_google_sheet(sheet_url, poll_state=None, timeout=30):
+    """
+    Loads a sheet shared as "anyone with the link can view" through its CSV export.
+
+    For delta polling, pass the same dict as poll_state on every call (e.g. one
+    kept in st.session_state). The sheet is then requested conditionally and
+    None is returned while it has not changed since the previous call. A sheet
+    that did change is returned whole; scrapetheweb's row fingerprints then
+    limit the work to its new and changed rows.
+    """
+    headers = {}
+    if poll_state is not None:
+        if poll_state.get("etag"):
+            headers["If-None-Match"] = poll_state["etag"]
+        if poll_state.get("last_modified"):
+            headers["If-Modified-Since"] = poll_state["last_modified"]
+
+    response = requests.get(google_sheet_csv_url(sheet_url), headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    # Private sheets redirect to the sign-in page instead of failing
+    if "text/csv" not in response.headers.get("Content-Type", ""):
+        raise PermissionError("The sheet is not shared publicly; share it as 'anyone with the link can view'.")
+
+    if poll_state is not None:
+        # The export does not always send validators, so compare contents too
+        digest = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+        validators = dict(
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            digest=digest
+        )
+        if poll_state.get("digest") == digest:
+            poll_state.update(validators)
+            return None
+
+    sheet = pd.read_csv(io.BytesIO(response.content))
+    if poll_state is not None:
+        # Only once parsed, so a sheet that failed to parse is read again next time
+        poll_state.update(validators)
+    return sheet
 
 def run_llm_query(data, query):
     """ Placeholder function to simulate LLM data processing. """
@@ -0,0 +1,289 @@
+import csv
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+EXPORT_COLUMNS = ["row", "value", "query", "found", "top_title", "top_link", "top_snippet", "result"]
+
+# Excel refuses longer cell values
+XLSX_MAX_CELL = 32767
+# Rows per worksheet Excel can open, the header included
+XLSX_MAX_ROWS = 1_048_576
+
+
+def export_projection(query: Optional[str], result: Optional[Dict]) -> Dict[str, Any]:
+    """
+    The exported columns that depend only on the query: the query, the SERP
+    response as JSON and its first organic result, pulled out so the file is
+    readable as a table
+    """
+    top = {}
+    if result is not None:
+        top = next(iter(result.get("organic_results") or []), {})
+    return {
+        "query": query,
+        "found": result is not None,
+        "top_title": top.get("title"),
+        "top_link": top.get("link"),
+        "top_snippet": top.get("snippet"),
+        "result": json.dumps(result) if result is not None else None
+    }
+
+
+def export_row(row: int, value: Any, query: Optional[str], result: Optional[Dict]) -> Dict[str, Any]:
+    """
+    One exported row: the input value and its query's projection
+    """
+    return _with_row(row, value, export_projection(query, result))
+
+
+def _with_row(row: int, value: Any, projection: Dict[str, Any]) -> Dict[str, Any]:
+    return {"row": row, "value": None if pd.isna(value) else str(value), **projection}
+
+
+class ExportWriter:
+    """
+    Appends batches of export rows to a file without keeping them in memory
+    """
+    extension = ""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rows: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class CsvWriter(ExportWriter):
+    extension = "csv"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=EXPORT_COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonLinesWriter(ExportWriter):
+    extension = "jsonl"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            # Keep the response nested rather than as an escaped string
+            row = dict(row, result=json.loads(row["result"]) if row["result"] else None)
+            self._file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(ExportWriter):
+    """
+    Writes one row group per row_group_size rows
+    """
+    extension = "parquet"
+
+    def __init__(self, path: str, row_group_size: int = 10_000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(path)
+        self.row_group_size = row_group_size
+        self._pa = pa
+        self._schema = pa.schema([
+            ("row", pa.int64()),
+            ("value", pa.string()),
+            ("query", pa.string()),
+            ("found", pa.bool_()),
+            ("top_title", pa.string()),
+            ("top_link", pa.string()),
+            ("top_snippet", pa.string()),
+            ("result", pa.string())
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._pending: List[Dict[str, Any]] = []
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self._pending.extend(rows)
+        while len(self._pending) >= self.row_group_size:
+            self._flush(self._pending[:self.row_group_size])
+            del self._pending[:self.row_group_size]
+
+    def _flush(self, rows: List[Dict[str, Any]]):
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        if self._pending:
+            self._flush(self._pending)
+            self._pending = []
+        self._writer.close()
+
+
+class XlsxWriter(ExportWriter):
+    """
+    openpyxl write-only workbook, which streams rows to disk as they are appended.
+
+    Rows past what one worksheet holds continue on a new one (results_2,
+    results_3, ...), each with its own header.
+    """
+    extension = "xlsx"
+
+    def __init__(self, path: str, max_rows: int = XLSX_MAX_ROWS):
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        super().__init__(path)
+        self.max_rows = max_rows
+        self._illegal = ILLEGAL_CHARACTERS_RE
+        self._workbook = Workbook(write_only=True)
+        self._sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self._sheets += 1
+        name = "results" if self._sheets == 1 else f"results_{self._sheets}"
+        self._sheet = self._workbook.create_sheet(name)
+        self._sheet.append(EXPORT_COLUMNS)
+        self._sheet_rows = 1
+
+    def write(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            if self._sheet_rows >= self.max_rows:
+                self._new_sheet()
+            self._sheet_rows += 1
+            if row["result"] and len(row["result"]) > XLSX_MAX_CELL:
+                row = dict(row, result=row["result"][:XLSX_MAX_CELL])
+            # Control characters in snippets would otherwise abort the save
+            self._sheet.append([
+                self._illegal.sub("", value) if isinstance(value, str) else value
+                for value in (row[column] for column in EXPORT_COLUMNS)
+            ])
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+EXPORT_FORMATS = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "parquet": ParquetWriter,
+    "xlsx": XlsxWriter,
+    "excel": XlsxWriter
+}
+
+
+class ExportStream:
+    """
+    Writes scrapetheweb results to a file in input row order while they arrive.
+
+    Results come in per distinct query and in any order. Rows are released as
+    soon as every row before them has its result, in batches of batch_size.
+    Only the exported projection of each result is kept, and only until the
+    last row using it is written, so memory holds the results of queries
+    whose rows are still waiting, not every response. The file is written
+    under a temporary name and renamed when the export completes.
+    """
+    def __init__(
+        self,
+        export_format: str,
+        export_path: str,
+        name: str,
+        values: pd.Series,
+        queries: List[str],
+        row_to_query: List[Optional[int]],
+        batch_size: int = 1000
+    ):
+        writer_class = EXPORT_FORMATS.get(export_format.lower())
+        if writer_class is None:
+            raise ValueError(
+                f"Unsupported export format '{export_format}', expected one of {', '.join(EXPORT_FORMATS)}"
+            )
+        os.makedirs(export_path, exist_ok=True)
+        self.path = os.path.join(export_path, f"{name}.{writer_class.extension}")
+        self._writer = writer_class(self.path + ".part")
+
+        self.values = values
+        self.queries = queries
+        self.row_to_query = row_to_query
+        self.batch_size = batch_size
+        self.rows_written = 0
+
+        # Projection of each query's result, dropped after its last row is written
+        self._results: Dict[int, Dict[str, Any]] = {}
+        self._last_row: Dict[int, int] = {}
+        for row, query_index in enumerate(row_to_query):
+            if query_index is not None:
+                self._last_row[query_index] = row
+        self._batch: List[Dict[str, Any]] = []
+
+    def add(self, index: int, result: Optional[Dict]):
+        """
+        Record the result of distinct query index and write every row it unblocks
+        """
+        row = self.rows_written + len(self._batch)
+        # A resumed or repeated result that no waiting row needs is not kept
+        if self._last_row.get(index, -1) >= row:
+            self._results[index] = export_projection(self.queries[index], result)
+        self._release()
+
+    def _release(self, final: bool = False):
+        while self.rows_written + len(self._batch) < len(self.row_to_query):
+            row = self.rows_written + len(self._batch)
+            query_index = self.row_to_query[row]
+            if query_index is None:
+                # Skipped for a missing placeholder value, exported as not found
+                self._batch.append(export_row(row, self.values.iloc[row], None, None))
+            elif query_index not in self._results and not final:
+                break
+            else:
+                projection = self._results.get(query_index) or export_projection(self.queries[query_index], None)
+                self._batch.append(_with_row(row, self.values.iloc[row], projection))
+                if self._last_row[query_index] == row:
+                    self._results.pop(query_index, None)
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if self._batch:
+            self._writer.write(self._batch)
+            self.rows_written += len(self._batch)
+            self._batch = []
+
+    def close(self) -> str:
+        """
+        Write the remaining rows, finish the file and move it into place.
+        Rows whose query never reported back are exported as not found.
+
+        Returns:
+            Path of the exported file
+        """
+        self._release(final=True)
+        self._flush()
+        self._writer.close()
+        os.replace(self.path + ".part", self.path)
+        return self.path
+
+    def abort(self):
+        """
+        Drop the partial file of an interrupted run
+        """
+        try:
+            self._writer.close()
+        finally:
+            if os.path.exists(self.path + ".part"):
+                os.remove(self.path + ".part")
@@ -0,0 +1,191 @@
+import json
+import re
+from typing import Callable, Dict, List, Optional
+
+# Precompiled once; these run over every snippet of every row
+EMAIL_RE = re.compile(r"\b[A-Za-z0-9._%+-]+@((?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,})\b")
+PHONE_RE = re.compile(r"(?<![\w+(])[+(]?\d[\d\s().-]{7,}\d\b")
+URL_RE = re.compile(r"https?://(?:www\.)?((?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,})", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_DOMAIN_RE = re.compile(r"((?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,})")
+
+# Keys of a result or knowledge graph entry that say whose page it is
+_LINK_KEYS = ("link", "website", "domain", "displayed_link")
+
+# Company suffixes that never appear in the domain
+_ENTITY_STOPWORDS = {
+    "inc", "llc", "ltd", "limited", "corp", "corporation", "co", "company", "the",
+    "gmbh", "ag", "sa", "plc", "group", "holdings", "and"
+}
+
+# Parts of a SerpAPI payload that describe the request or ads, not the entity
+_SKIPPED_KEYS = {"ads", "search_metadata", "search_parameters", "serpapi_pagination", "pagination"}
+
+
+def _entity_words(entity: str) -> List[str]:
+    return [word for word in _WORD_RE.findall(str(entity).lower()) if word not in _ENTITY_STOPWORDS]
+
+
+def domain_matches_entity(domain: str, entity: str) -> bool:
+    """
+    True when a label of the domain (without TLD) is the entity's name, e.g.
+    tesla.com for "Tesla Inc" or fordmotor.com for "Ford Motor Company", or
+    holds every word of the name as a hyphen-separated part, e.g.
+    tesla-energy.com or ford-motor-europe.com.
+
+    Partial names are rejected: "Intel" does not own intelligence.com and
+    "United Airlines" does not own united-bank.com.
+    """
+    words = _entity_words(entity)
+    if not words:
+        return False
+    joined = "".join(words)
+    for label in domain.lower().split(".")[:-1]:
+        if label.replace("-", "") == joined:
+            return True
+        # Short names ("ace", "gm") are too common to match as one part among others
+        if len(joined) >= 4 and set(words) <= set(label.split("-")):
+            return True
+    return False
+
+
+def _entry_domain(value) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    match = URL_RE.search(value) or _DOMAIN_RE.fullmatch(value.strip())
+    return match.group(1).lower() if match else None
+
+
+def _owned_texts(entity: str, search_results) -> List[str]:
+    """
+    Texts of the results and knowledge graph entries whose link or website
+    belongs to the entity, e.g. for fields that carry no domain of their own
+    """
+    if isinstance(search_results, str):
+        try:
+            search_results = json.loads(search_results)
+        except ValueError:
+            return []
+
+    texts = []
+    stack = [search_results]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            domains = (_entry_domain(item.get(key)) for key in _LINK_KEYS)
+            if any(domain and domain_matches_entity(domain, entity) for domain in domains):
+                texts.extend(_texts(item))
+            else:
+                stack.extend(value for key, value in item.items() if key not in _SKIPPED_KEYS)
+        elif isinstance(item, list):
+            stack.extend(item)
+    return texts
+
+
+def _texts(search_results) -> List[str]:
+    """
+    Collect every string in a search payload, skipping metadata and ads
+    """
+    if isinstance(search_results, str):
+        try:
+            search_results = json.loads(search_results)
+        except ValueError:
+            return [search_results]
+
+    texts = []
+    stack = [search_results]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(value for key, value in item.items() if key not in _SKIPPED_KEYS)
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, str):
+            texts.append(item)
+    return texts
+
+
+def extract_email(entity: str, texts: List[str]) -> Optional[str]:
+    """
+    The only email address whose domain belongs to the entity
+    """
+    candidates = {
+        match.group(0).lower()
+        for text in texts
+        for match in EMAIL_RE.finditer(text)
+        if domain_matches_entity(match.group(1), entity)
+    }
+    return candidates.pop() if len(candidates) == 1 else None
+
+
+def extract_phone(entity: str, texts: List[str]) -> Optional[str]:
+    """
+    The phone number, when every text agrees on a single one. Meant for the
+    texts of the entity's own entries (see OWNED_FIELDS)
+    """
+    candidates = {}
+    for text in texts:
+        for match in PHONE_RE.finditer(text):
+            digits = re.sub(r"\D", "", match.group(0))
+            if 10 <= len(digits) <= 15:
+                # Compare national numbers so "+1 555..." and "555..." agree
+                candidates.setdefault(digits[-10:], match.group(0).strip())
+    return next(iter(candidates.values())) if len(candidates) == 1 else None
+
+
+def extract_domain(entity: str, texts: List[str]) -> Optional[str]:
+    """
+    The only linked or emailed domain that belongs to the entity
+    """
+    candidates = set()
+    for text in texts:
+        for pattern in (URL_RE, EMAIL_RE):
+            for match in pattern.finditer(text):
+                domain = match.group(1).lower()
+                if domain_matches_entity(domain, entity):
+                    candidates.add(domain)
+    return candidates.pop() if len(candidates) == 1 else None
+
+
+# field name -> extractor(entity, texts); an extractor returns None when unsure
+EXTRACTORS: Dict[str, Callable[[str, List[str]], Optional[str]]] = {
+    "email": extract_email,
+    "phone": extract_phone,
+    "domain": extract_domain,
+}
+
+# Fields whose extractor only sees the entries that link to the entity's own
+# domain, because the value itself does not say whom it belongs to
+OWNED_FIELDS = {"phone"}
+
+
+def register_extractor(
+    field: str,
+    extractor: Callable[[str, List[str]], Optional[str]],
+    owned_only: bool = False
+):
+    """
+    Add or replace the fast-path extractor for a field; with owned_only it
+    only gets the texts of entries linking to the entity's domain
+    """
+    EXTRACTORS[field] = extractor
+    if owned_only:
+        OWNED_FIELDS.add(field)
+    else:
+        OWNED_FIELDS.discard(field)
+
+
+def resolve_fast_path(entity: str, search_results, field: str = "email") -> Optional[str]:
+    """
+    Try to answer without the LLM.
+
+    Returns:
+        The extracted value when it is unambiguous, otherwise None so the row
+        goes to the LLM
+    """
+    extractor = EXTRACTORS.get(field)
+    if extractor is None:
+        return None
+    if field in OWNED_FIELDS:
+        return extractor(entity, _owned_texts(entity, search_results))
+    return extractor(entity, _texts(search_results))
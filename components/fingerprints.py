@@ -0,0 +1,173 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from time import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from components.cache import normalize_query
+
+# SQLite's default limit on bound parameters per statement is 999
+_LOOKUP_CHUNK = 900
+
+
+def row_fingerprint(query_template: str, query: str, columns: Dict[str, str]) -> str:
+    """
+    Fingerprint of one row's work: the template, the query rendered from it
+    and the column values that went into the query
+    """
+    payload = json.dumps([query_template, query, columns], sort_keys=True)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def row_fingerprints(query_template: str, queries: pd.Series, columns: Dict[str, pd.Series]) -> List[Optional[str]]:
+    """
+    Fingerprint every row from its rendered query (as from render_queries)
+    and the normalized values of the columns the template refers to, so a
+    row that only changed in whitespace is unchanged. Rows without a query
+    get None.
+    """
+    names = list(columns)
+    cells = [_cells(columns[name]) for name in names]
+    fingerprints: List[Optional[str]] = []
+    for query, *values in zip(_cells(queries), *cells):
+        if query is None:
+            fingerprints.append(None)
+        else:
+            fingerprints.append(row_fingerprint(query_template, query, dict(zip(names, values))))
+    return fingerprints
+
+
+def _cells(values: pd.Series) -> List[Optional[str]]:
+    # NA is not JSON serializable
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+class FingerprintStore:
+    """
+    SQLite record of the rows processed by earlier runs and their results.
+
+    Each fingerprint points at its normalized query, and every query's result
+    is stored once however many rows share it. A rerun over a sheet that
+    gained or changed a few rows looks up all fingerprints and only fetches
+    the rows it has not seen. Results older than max_age seconds count as
+    unseen, so unchanged rows are still refreshed eventually.
+    """
+    def __init__(self, db_name: str = 'fingerprints.db', max_age: Optional[float] = 7 * 86400):
+        self.db_name = db_name
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_name, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS row_fingerprints (
+                fingerprint TEXT PRIMARY KEY,
+                query_key TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS query_results (
+                query_key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._connection.commit()
+
+    def lookup_queries(self, fingerprints: Iterable[Optional[str]]) -> Dict[str, str]:
+        """
+        Query keys of the fingerprints seen before whose result is still fresh,
+        by fingerprint, without loading the results
+        """
+        oldest = time() - self.max_age if self.max_age is not None else 0
+        fingerprints = [fingerprint for fingerprint in dict.fromkeys(fingerprints) if fingerprint is not None]
+        found: Dict[str, str] = {}
+        with self._lock:
+            for start in range(0, len(fingerprints), _LOOKUP_CHUNK):
+                chunk = fingerprints[start:start + _LOOKUP_CHUNK]
+                rows = self._connection.execute(
+                    "SELECT f.fingerprint, q.query_key FROM row_fingerprints f "
+                    "JOIN query_results q ON q.query_key = f.query_key "
+                    f"WHERE f.fingerprint IN ({', '.join('?' * len(chunk))}) AND q.updated_at >= ?",
+                    (*chunk, oldest)
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def iter_results(self, query_keys: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+        """
+        (query_key, result) of the stored queries, read a chunk at a time so
+        only one chunk of results is in memory
+        """
+        query_keys = list(dict.fromkeys(query_keys))
+        for start in range(0, len(query_keys), _LOOKUP_CHUNK):
+            chunk = query_keys[start:start + _LOOKUP_CHUNK]
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT query_key, result FROM query_results WHERE query_key IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+            for query_key, result in rows:
+                yield query_key, json.loads(result)
+
+    def lookup(self, fingerprints: Iterable[Optional[str]]) -> Dict[str, Any]:
+        """
+        Stored results of the fingerprints seen before, by fingerprint. Rows
+        sharing a query share its result object.
+        """
+        query_keys = self.lookup_queries(fingerprints)
+        results = dict(self.iter_results(query_keys.values()))
+        return {
+            fingerprint: results[query_key]
+            for fingerprint, query_key in query_keys.items() if query_key in results
+        }
+
+    def record(self, rows: Iterable[Tuple[str, str, Any]]):
+        """
+        Store (fingerprint, query, result) rows in one transaction
+        """
+        now = time()
+        fingerprints = []
+        results = {}
+        for fingerprint, query, result in rows:
+            query_key = normalize_query(query)
+            fingerprints.append((fingerprint, query_key, now))
+            results[query_key] = (query_key, json.dumps(result), now)
+        if not fingerprints:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO row_fingerprints (fingerprint, query_key, updated_at) VALUES (?, ?, ?)",
+                fingerprints
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO query_results (query_key, result, updated_at) VALUES (?, ?, ?)",
+                results.values()
+            )
+            self._connection.commit()
+
+    def prune(self, older_than: Optional[float] = None) -> int:
+        """
+        Delete fingerprints and results not updated for older_than seconds
+        (max_age by default)
+
+        Returns:
+            Number of fingerprints deleted
+        """
+        older_than = older_than if older_than is not None else self.max_age
+        if older_than is None:
+            return 0
+        cutoff = time() - older_than
+        with self._lock:
+            deleted = self._connection.execute(
+                "DELETE FROM row_fingerprints WHERE updated_at < ?", (cutoff,)
+            ).rowcount
+            self._connection.execute("DELETE FROM query_results WHERE updated_at < ?", (cutoff,))
+            self._connection.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
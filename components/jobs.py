@@ -0,0 +1,239 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+
+def job_id_for(query_template: str, values: List[str]) -> str:
+    """
+    Deterministic job id, so rerunning the same template over the same column resumes it
+    """
+    payload = json.dumps([query_template, values])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class JobStore:
+    """
+    SQLite record of fetch jobs and the state of every query in them.
+
+    Row state changes are buffered and written in one transaction every
+    checkpoint_interval changes or checkpoint_seconds, whichever comes first.
+    Work recorded after the last checkpoint is simply redone on resume.
+    """
+    def __init__(
+        self,
+        db_name: str = 'jobs.db',
+        checkpoint_interval: int = 50,
+        checkpoint_seconds: float = 5.0
+    ):
+        self.db_name = db_name
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_seconds = checkpoint_seconds
+
+        self._lock = threading.Lock()
+        self._buffer: List[tuple] = []
+        self._last_checkpoint = time()
+        self._connection = sqlite3.connect(db_name, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                query_template TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_rows (
+                job_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, row_index)
+            );
+        """)
+        self._connection.commit()
+
+    def start(
+        self,
+        job_id: str,
+        query_template: str,
+        column_name: str,
+        values: List[str],
+        retry_failed: bool = False,
+        max_age: Optional[float] = None
+    ) -> List[int]:
+        """
+        Create the job, resume it if it was interrupted, or run it again from
+        the start if it finished.
+
+        On resume, rows left in flight by a crash go back to pending, as do
+        rows done more than max_age seconds ago, and failed rows when
+        retry_failed is set.
+
+        Returns:
+            Indexes of the values that still need fetching
+        """
+        now = time()
+        with self._lock:
+            job = self._connection.execute(
+                "SELECT status FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+
+            if job is None:
+                self._connection.execute(
+                    "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, query_template, column_name, "running", len(values), now, now)
+                )
+                self._connection.executemany(
+                    "INSERT INTO job_rows (job_id, row_index, value, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    ((job_id, index, value, PENDING, now) for index, value in enumerate(values))
+                )
+            elif job[0] == "finished":
+                # Its results are not kept past the run; unchanged rows come back
+                # from the fingerprints and the response cache, within their own ages
+                self._connection.execute(
+                    "UPDATE job_rows SET status = ?, result = NULL, error = NULL, updated_at = ? WHERE job_id = ?",
+                    (PENDING, now, job_id)
+                )
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE job_id = ?",
+                    (now, job_id)
+                )
+            else:
+                requeue = [IN_FLIGHT, FAILED] if retry_failed else [IN_FLIGHT]
+                oldest = now - max_age if max_age is not None else float("-inf")
+                self._connection.execute(
+                    f"UPDATE job_rows SET status = ?, result = NULL, updated_at = ? "
+                    f"WHERE job_id = ? AND (status IN ({', '.join('?' * len(requeue))}) "
+                    f"OR (status = ? AND updated_at < ?))",
+                    (PENDING, now, job_id, *requeue, DONE, oldest)
+                )
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE job_id = ?",
+                    (now, job_id)
+                )
+            self._connection.commit()
+
+            rows = self._connection.execute(
+                "SELECT row_index FROM job_rows WHERE job_id = ? AND status = ? ORDER BY row_index",
+                (job_id, PENDING)
+            ).fetchall()
+        return [row_index for (row_index,) in rows]
+
+    def _record(self, job_id: str, index: int, status: str, result: Any = None, error: str = None):
+        with self._lock:
+            self._buffer.append((
+                status,
+                json.dumps(result) if result is not None else None,
+                error,
+                time(),
+                job_id,
+                index
+            ))
+            due = len(self._buffer) >= self.checkpoint_interval \
+                or time() - self._last_checkpoint >= self.checkpoint_seconds
+        if due:
+            self.checkpoint()
+
+    def mark_in_flight(self, job_id: str, index: int):
+        self._record(job_id, index, IN_FLIGHT)
+
+    def mark_done(self, job_id: str, index: int, result: Any):
+        self._record(job_id, index, DONE, result=result)
+
+    def mark_failed(self, job_id: str, index: int, error: str = "No result"):
+        self._record(job_id, index, FAILED, error=error)
+
+    def checkpoint(self):
+        """
+        Write all buffered row state changes in one transaction
+        """
+        with self._lock:
+            if self._buffer:
+                self._connection.executemany(
+                    "UPDATE job_rows SET status = ?, result = ?, error = ?, updated_at = ? "
+                    "WHERE job_id = ? AND row_index = ?",
+                    self._buffer
+                )
+                self._connection.commit()
+                self._buffer.clear()
+            self._last_checkpoint = time()
+
+    def finish(self, job_id: str):
+        self.checkpoint()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'finished', updated_at = ? WHERE job_id = ?",
+                (time(), job_id)
+            )
+            self._connection.commit()
+
+    def iter_results(self, job_id: str, chunk_size: int = 1000) -> Iterator[Tuple[int, Any]]:
+        """
+        (row index, result) of the completed rows of a job, read chunk_size
+        rows at a time so only one chunk of results is in memory
+        """
+        self.checkpoint()
+        last_index = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT row_index, result FROM job_rows "
+                    "WHERE job_id = ? AND status = ? AND row_index > ? ORDER BY row_index LIMIT ?",
+                    (job_id, DONE, last_index, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row_index, result in rows:
+                yield row_index, json.loads(result)
+            last_index = rows[-1][0]
+
+    def results(self, job_id: str) -> Dict[int, Any]:
+        """
+        Results of the completed rows of a job, by row index
+        """
+        return dict(self.iter_results(job_id))
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        """
+        Number of rows per status
+        """
+        self.checkpoint()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM job_rows WHERE job_id = ? GROUP BY status",
+                (job_id,)
+            ).fetchall()
+        counts = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT job_id, query_template, column_name, status, total, created_at, updated_at "
+                "FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("job_id", "query_template", "column_name", "status", "total", "created_at", "updated_at")
+        return dict(zip(keys, row))
+
+    def close(self):
+        self.checkpoint()
+        with self._lock:
+            self._connection.close()
@@ -1,68 +1,549 @@
-import psycopg2
+from psycopg2.extras import execute_values
+import aiohttp
+import asyncio
 import openai
 import json
 import os
+import threading
+from time import perf_counter
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+from components.cache import ResponseCache, llm_cache_key
+from components.condense import condense_search_results
+from components.db import get_connection
+from components.fastpath import resolve_fast_path
+from components.metrics import DB_BATCH_SECONDS, DB_ROWS, LLM_REQUEST_SECONDS, record_llm_usage
+from components.ratelimiting import RateLimiter
+from components.retry import RetryPolicy, call_with_retry, call_with_retry_async, classify_openai_error, get_breaker
+from components.storeresults import ensure_schema
+from components.tokens import count_tokens
+
+# Token budget for the condensed search results of a single company
+RESULT_TOKEN_BUDGET = 1000
+
+MODEL = "text-davinci-003"
+PROMPT_TEMPLATE = "Extract the contact email address for the company '{company_name}' from the following data: {search_results}"
 
 # Set up OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# PostgreSQL connection setup
-connection = psycopg2.connect(
-    dbname="my_database",
-    user="your_username",
-    password="your_password",
-    host="localhost"
-)
-cursor = connection.cursor()
+# Rate limited, timed-out and 5xx requests are retried with backoff
+OPENAI_RETRY = RetryPolicy()
+
+def _completion(endpoint: str, create, token_cost: Optional[int] = None, **kwargs):
+    """
+    One OpenAI request with retries and a shared circuit breaker, recording
+    the latency of every attempt and the tokens used. With token_cost, every
+    attempt first waits for one request and that many tokens from the
+    limiters shared with AsyncExtractor.
+    """
+    request_limiter = token_limiter = None
+    if token_cost is not None:
+        request_limiter, token_limiter = openai_limiters()
+        # A single oversized prompt waits for a full minute's budget
+        token_cost = min(token_cost, OPENAI_TOKENS_PER_MINUTE)
+
+    def attempt():
+        if request_limiter is not None:
+            request_limiter.wait_if_needed()
+            token_limiter.wait_if_needed(token_cost)
+        start = perf_counter()
+        try:
+            response = create(**kwargs)
+        except Exception:
+            LLM_REQUEST_SECONDS.observe(perf_counter() - start, endpoint=endpoint, outcome="error")
+            raise
+        LLM_REQUEST_SECONDS.observe(perf_counter() - start, endpoint=endpoint, outcome="ok")
+        record_llm_usage(response)
+        return response
+
+    return call_with_retry(
+        attempt, classify_openai_error, OPENAI_RETRY, get_breaker("openai"), request_limiter, provider="openai"
+    )
 
 # Function to send JSON data to OpenAI and extract relevant information
-def extract_relevant_data(company_name, search_results):
+def extract_relevant_data(
+    company_name,
+    search_results,
+    max_result_tokens=RESULT_TOKEN_BUDGET,
+    cache: Optional[ResponseCache] = None,
+    api_key: Optional[str] = None
+):
+    # Keep only the snippets and contact fields that matter, within the token budget
+    search_results = condense_search_results(company_name, search_results, max_result_tokens)
+
+    # Identical inputs were already extracted, possibly for another upload
+    if cache is not None:
+        key = llm_cache_key(MODEL, PROMPT_TEMPLATE, company_name, search_results)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     # Craft a prompt for OpenAI with the relevant search results
-    prompt = f"Extract the contact email address for the company '{company_name}' from the following data: {json.dumps(search_results)}"
+    prompt = PROMPT_TEMPLATE.format(company_name=company_name, search_results=json.dumps(search_results))
     
     try:
-        response = openai.Completion.create(
-            engine="text-davinci-003",
+        response = _completion(
+            "completion",
+            openai.Completion.create,
+            engine=MODEL,
             prompt=prompt,
             max_tokens=50,
-            temperature=0
+            temperature=0,
+            # Per request, so jobs of different sessions each use their own key
+            api_key=api_key
         )
         # Extracted information
         extracted_data = response.choices[0].text.strip()
+        if cache is not None and extracted_data:
+            cache.set(key, extracted_data)
         return extracted_data
     except Exception as e:
         print(f"Error with OpenAI API: {e}")
         return None
 
-# Main processing function
-def process_and_store_extracted_data():
-    # Step 1: Retrieve data from PostgreSQL
-    cursor.execute("SELECT id, company_name, search_results FROM filtered_db WHERE extracted_data IS NULL")
-    rows = cursor.fetchall()
-    
-    # Step 2: Process each row
-    for row in rows:
-        record_id, company_name, search_results = row
-        
-        # Step 3: Send data to OpenAI for extraction
-        extracted_data = extract_relevant_data(company_name, search_results)
-        
-        if extracted_data:
-            # Step 4: Update the extracted data back into the database
-            update_query = """
-            UPDATE filtered_db
-            SET extracted_data = %s
-            WHERE id = %s
-            """
-            cursor.execute(update_query, (extracted_data, record_id))
-            connection.commit()
-            print(f"Updated extracted data for {company_name}: {extracted_data}")
+# Process-wide OpenAI budget for concurrent extraction, set to the account's tier
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_RPM", "3500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TPM", "90000"))
+COMPLETION_MAX_TOKENS = 50
+
+_openai_limiters: Optional[Tuple[RateLimiter, RateLimiter]] = None
+_openai_limiters_lock = threading.Lock()
+
+def openai_limiters() -> Tuple[RateLimiter, RateLimiter]:
+    """
+    The requests-per-minute and tokens-per-minute limiters shared by every
+    AsyncExtractor in the process
+    """
+    global _openai_limiters
+    with _openai_limiters_lock:
+        if _openai_limiters is None:
+            _openai_limiters = (
+                RateLimiter(max_per_second=None, max_per_day=None,
+                            max_per_minute=OPENAI_REQUESTS_PER_MINUTE, name="openai_requests"),
+                RateLimiter(max_per_second=None, max_per_day=None,
+                            max_per_minute=OPENAI_TOKENS_PER_MINUTE, name="openai_tokens")
+            )
+        return _openai_limiters
+
+class AsyncExtractor:
+    """
+    Runs up to max_concurrency completions at once under a requests-per-minute
+    and an estimated tokens-per-minute budget.
+
+    Each prompt's tokens (plus the completion allowance) are counted before it
+    is sent, and the request waits until both limiters have room, so a burst
+    of long prompts slows down instead of tripping 429s. Create one per event
+    loop.
+    """
+    def __init__(
+        self,
+        max_concurrency: int = 50,
+        max_result_tokens: int = RESULT_TOKEN_BUDGET,
+        cache: Optional[ResponseCache] = None,
+        request_limiter: Optional[RateLimiter] = None,
+        token_limiter: Optional[RateLimiter] = None,
+        api_key: Optional[str] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_result_tokens = max_result_tokens
+        self.cache = cache
+        self.api_key = api_key
+        default_requests, default_tokens = openai_limiters()
+        self.request_limiter = request_limiter or default_requests
+        self.token_limiter = token_limiter or default_tokens
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _complete(self, prompt: str):
+        cost = count_tokens(prompt, MODEL) + COMPLETION_MAX_TOKENS
+
+        async def attempt():
+            await self.request_limiter.acquire()
+            await self.token_limiter.acquire(cost)
+            start = perf_counter()
+            try:
+                response = await openai.Completion.acreate(
+                    engine=MODEL,
+                    prompt=prompt,
+                    max_tokens=COMPLETION_MAX_TOKENS,
+                    temperature=0,
+                    api_key=self.api_key
+                )
+            except Exception:
+                LLM_REQUEST_SECONDS.observe(perf_counter() - start, endpoint="completion", outcome="error")
+                raise
+            LLM_REQUEST_SECONDS.observe(perf_counter() - start, endpoint="completion", outcome="ok")
+            record_llm_usage(response)
+            return response
+
+        # A 429 pauses every request sharing the limiter, not just this one
+        return await call_with_retry_async(
+            attempt, classify_openai_error, OPENAI_RETRY, get_breaker("openai"),
+            self.request_limiter, provider="openai"
+        )
+
+    async def extract(self, company_name, search_results) -> Optional[str]:
+        """
+        Async extract_relevant_data, sharing its prompt and cache entries
+        """
+        search_results = condense_search_results(company_name, search_results, self.max_result_tokens)
+
+        if self.cache is not None:
+            key = llm_cache_key(MODEL, PROMPT_TEMPLATE, company_name, search_results)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        prompt = PROMPT_TEMPLATE.format(company_name=company_name, search_results=json.dumps(search_results))
+        async with self._semaphore:
+            try:
+                response = await self._complete(prompt)
+            except Exception as e:
+                print(f"Error with OpenAI API: {e}")
+                return None
+
+        extracted_data = response.choices[0].text.strip()
+        if self.cache is not None and extracted_data:
+            self.cache.set(key, extracted_data)
+        return extracted_data
+
+    async def stream(
+        self,
+        records: Union[Iterable[Tuple], AsyncIterable[Tuple]]
+    ) -> AsyncIterator[Tuple[Any, Optional[str]]]:
+        """
+        Yield (record_id, extracted_data) for (record_id, company_name,
+        search_results) records in completion order, as each one finishes.
+
+        Records are read lazily, at most twice max_concurrency at a time, and
+        all requests share one keep-alive session. records may be an async
+        iterable, e.g. one fed by a search that is still running.
+        """
+        async def run(record_id, company_name, search_results):
+            return record_id, await self.extract(company_name, search_results)
+
+        source = records.__aiter__() if hasattr(records, "__aiter__") else None
+        records = iter(records) if source is None else None
+        pending = set()
+        fetch = None
+        exhausted = False
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            token = openai.aiosession.set(session)
+            try:
+                while True:
+                    while not exhausted and fetch is None and len(pending) < 2 * self.max_concurrency:
+                        if source is not None:
+                            # Wait for the next record alongside the requests in flight
+                            fetch = asyncio.ensure_future(source.__anext__())
+                            break
+                        record = next(records, None)
+                        if record is None:
+                            exhausted = True
+                        else:
+                            pending.add(asyncio.ensure_future(run(*record)))
+                    waiting = pending | ({fetch} if fetch is not None else set())
+                    if not waiting:
+                        return
+                    done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task is fetch:
+                            fetch = None
+                            try:
+                                pending.add(asyncio.ensure_future(run(*task.result())))
+                            except StopAsyncIteration:
+                                exhausted = True
+                        else:
+                            pending.discard(task)
+                            yield task.result()
+            finally:
+                for task in pending | ({fetch} if fetch is not None else set()):
+                    task.cancel()
+                openai.aiosession.reset(token)
+
+def extract_concurrently(
+    records: Iterable[Tuple],
+    max_concurrency: int = 50,
+    max_result_tokens: int = RESULT_TOKEN_BUDGET,
+    cache: Optional[ResponseCache] = None
+) -> Dict:
+    """
+    Blocking wrapper around AsyncExtractor.stream for synchronous callers
+
+    Returns:
+        Dict mapping every record id to its extracted data or None
+    """
+    async def collect():
+        extractor = AsyncExtractor(max_concurrency, max_result_tokens, cache)
+        return {record_id: value async for record_id, value in extractor.stream(records)}
+
+    return asyncio.run(collect())
+
+# Batched extraction: several companies share one request and answer in JSON
+BATCH_MODEL = "gpt-3.5-turbo-1106"
+
+BATCH_INSTRUCTIONS = (
+    "For each company below, extract its contact email address from its search results. "
+    "Respond with a JSON object of the form "
+    '{"results": [{"id": <company id>, "extracted_data": <email address or null>}]} '
+    "containing exactly one entry per company id.\n\n"
+)
+
+def _batch_entry(record_id, company_name, search_results) -> str:
+    return json.dumps({"id": record_id, "company": company_name, "search_results": search_results})
+
+def plan_batches(
+    records: List[Tuple],
+    max_batch_size: int = 20,
+    max_prompt_tokens: int = 12000,
+    model: str = BATCH_MODEL
+) -> List[List[Tuple]]:
+    """
+    Greedily pack (record_id, company_name, search_results) records, with
+    search_results already condensed, into batches
+    that stay under both max_batch_size and max_prompt_tokens. A record that is
+    too large on its own gets a batch to itself.
+    """
+    budget = max_prompt_tokens - count_tokens(BATCH_INSTRUCTIONS, model)
+    batches = []
+    batch, batch_tokens = [], 0
+
+    for record in records:
+        tokens = count_tokens(_batch_entry(*record), model)
+        if batch and (len(batch) >= max_batch_size or batch_tokens + tokens > budget):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(record)
+        batch_tokens += tokens
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+def extract_relevant_data_batch(
+    records: List[Tuple],
+    model: str = BATCH_MODEL,
+    cache: Optional[ResponseCache] = None
+) -> Dict:
+    """
+    Extract data for several (record_id, company_name, search_results) records in one request.
+    search_results are sent as given, so condense them first. Records found
+    in the cache are answered from it and left out of the request.
+
+    Returns:
+        Dict mapping every record id to its extracted data, or None when the
+        model gave no answer for it
+    """
+    extracted: Dict = {record_id: None for record_id, _, _ in records}
+    keys: Dict = {}
+
+    if cache is not None:
+        misses = []
+        for record in records:
+            record_id, company_name, search_results = record
+            keys[record_id] = llm_cache_key(model, BATCH_INSTRUCTIONS, company_name, search_results)
+            extracted[record_id] = cache.get(keys[record_id])
+            if extracted[record_id] is None:
+                misses.append(record)
+        records = misses
+        if not records:
+            return extracted
+
+    prompt = BATCH_INSTRUCTIONS + "\n".join(_batch_entry(*record) for record in records)
+    max_tokens = 50 * len(records) + 50
+
+    try:
+        # Paced by the same RPM/TPM budget as AsyncExtractor's requests
+        response = _completion(
+            "chat",
+            openai.ChatCompletion.create,
+            token_cost=count_tokens(prompt, model) + max_tokens,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+            max_tokens=max_tokens,
+            temperature=0
+        )
+        answers = json.loads(response.choices[0].message.content).get("results", [])
+    except Exception as e:
+        print(f"Error with OpenAI API: {e}")
+        return extracted
+
+    # The model may echo ids back as strings, so match on their string form
+    ids_by_key = {str(record_id): record_id for record_id, _, _ in records}
+    for answer in answers:
+        if not isinstance(answer, dict):
+            continue
+        record_id = ids_by_key.get(str(answer.get("id")))
+        value = answer.get("extracted_data")
+        if record_id is not None and value:
+            extracted[record_id] = str(value).strip()
+            if cache is not None:
+                cache.set(keys[record_id], extracted[record_id])
+
+    return extracted
+
+def extract_records(
+    records: List[Tuple],
+    batch_size: int = 1,
+    max_prompt_tokens: int = 12000,
+    max_result_tokens: int = RESULT_TOKEN_BUDGET,
+    fast_path_field: Optional[str] = "email",
+    cache: Optional[ResponseCache] = None,
+    max_concurrency: int = 50
+) -> Dict:
+    """
+    Extract data for (record_id, company_name, search_results) records, trying
+    the regex fast path first and sending only the remaining records to the LLM.
+    With batch_size 1, up to max_concurrency single-record requests run at once.
+
+    Returns:
+        Dict mapping every record id to (extracted_data, resolved_by), where
+        resolved_by is 'fastpath' or 'llm'
+    """
+    extracted: Dict = {}
+
+    # Resolve unambiguous rows locally, only the rest go to the LLM
+    pending = []
+    for record_id, company_name, search_results in records:
+        fast_value = None
+        if fast_path_field:
+            fast_value = resolve_fast_path(company_name, search_results, fast_path_field)
+        if fast_value:
+            extracted[record_id] = (fast_value, "fastpath")
         else:
-            print(f"No data extracted for {company_name}")
+            pending.append((record_id, company_name, search_results))
+
+    if batch_size > 1:
+        pending = [
+            (record_id, company_name, condense_search_results(company_name, search_results, max_result_tokens))
+            for record_id, company_name, search_results in pending
+        ]
+        for batch in plan_batches(pending, batch_size, max_prompt_tokens):
+            for record_id, extracted_data in extract_relevant_data_batch(batch, cache=cache).items():
+                extracted[record_id] = (extracted_data, "llm")
+    elif pending:
+        # One request per record, many in flight at once
+        for record_id, extracted_data in extract_concurrently(
+            pending, max_concurrency, max_result_tokens, cache
+        ).items():
+            extracted[record_id] = (extracted_data, "llm")
+
+    return extracted
+
+def write_extracted_data(connection, updates: List[Tuple], page_size: int = 500):
+    """
+    Write (record_id, extracted_data, resolved_by) rows in one UPDATE ... FROM VALUES and commit
+    """
+    if not updates:
+        return
+    with DB_BATCH_SECONDS.time(operation="update"):
+        cursor = connection.cursor()
+        execute_values(
+            cursor,
+            """
+            UPDATE filtered_db AS f
+            SET extracted_data = v.extracted_data, resolved_by = v.resolved_by
+            FROM (VALUES %s) AS v (id, extracted_data, resolved_by)
+            WHERE f.id = v.id
+            """,
+            updates,
+            page_size=page_size
+        )
+        connection.commit()
+        cursor.close()
+    DB_ROWS.inc(len(updates), operation="update")
+
+# Main processing function
+def process_and_store_extracted_data(
+    batch_size: int = 1,
+    max_prompt_tokens: int = 12000,
+    max_result_tokens: int = RESULT_TOKEN_BUDGET,
+    fast_path_field: Optional[str] = "email",
+    cache_db: Optional[str] = "llm_cache.db",
+    cache_max_entries: Optional[int] = 100_000,
+    fetch_size: int = 1000,
+    commit_interval: int = 500
+):
+    """
+    With batch_size > 1, up to batch_size companies are extracted per request,
+    fewer when their search results would exceed max_prompt_tokens. Each
+    company's search results are condensed to max_result_tokens first.
+
+    Rows whose fast_path_field can be read unambiguously from the search
+    results are resolved without the LLM. Every row records the path that
+    resolved it in resolved_by ('fastpath' or 'llm').
+
+    LLM answers are cached in cache_db by model, prompt, company and condensed
+    results, so a company already extracted by any earlier job costs no request.
+    Pass cache_db=None to disable the cache.
+
+    Pending rows are read in pages of fetch_size by ascending id, and updates
+    are written in one statement and committed every commit_interval rows, so
+    memory stays flat however many rows are pending.
+    """
+    cache = None
+    if cache_db:
+        cache = ResponseCache(cache_db, table="llm_cache", ttl=None, max_entries=cache_max_entries)
+
+    with get_connection() as connection:
+        ensure_schema(connection)
+        updates = []
+
+        # Step 1: Page through pending rows by id. Each page is its own short
+        # query on filtered_db_pending_idx, so nothing is held open or
+        # materialized server side across the commits made while flushing.
+        read_cursor = connection.cursor()
+        try:
+            total = fast_resolved = 0
+            last_id = 0
+            while True:
+                with DB_BATCH_SECONDS.time(operation="fetch"):
+                    # Rows leased by a running worker (components/worker.py) are left to it
+                    read_cursor.execute("""
+                    SELECT id, company_name, search_results FROM filtered_db
+                    WHERE id > %s AND extracted_data IS NULL
+                      AND (lease_expires_at IS NULL OR lease_expires_at < now())
+                    ORDER BY id
+                    LIMIT %s
+                    """, (last_id, fetch_size))
+                    rows = read_cursor.fetchall()
+                if not rows:
+                    break
+                DB_ROWS.inc(len(rows), operation="fetch")
+                total += len(rows)
+                last_id = rows[-1][0]
+
+                # Step 2: Fast path, then OpenAI for whatever is left
+                extracted = extract_records(
+                    rows, batch_size, max_prompt_tokens, max_result_tokens, fast_path_field, cache
+                )
+
+                # Step 3: Queue the updates, flushing every commit_interval rows
+                for record_id, company_name, _ in rows:
+                    extracted_data, resolved_by = extracted[record_id]
+                    if extracted_data:
+                        updates.append((record_id, extracted_data, resolved_by))
+                        fast_resolved += resolved_by == "fastpath"
+                        print(f"Extracted data for {company_name} ({resolved_by}): {extracted_data}")
+                    else:
+                        print(f"No data extracted for {company_name}")
+
+                    if len(updates) >= commit_interval:
+                        write_extracted_data(connection, updates, commit_interval)
+                        updates.clear()
+
+            write_extracted_data(connection, updates, commit_interval)
+        finally:
+            read_cursor.close()
+
+    if total:
+        print(f"Fast path resolved {fast_resolved}/{total} rows")
 
-# Run the main processing function
-process_and_store_extracted_data()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+        cache.close()
 
-# Close the connection
-cursor.close()
-connection.close()
+if __name__ == "__main__":
+    # Run the main processing function
+    process_and_store_extracted_data(batch_size=20)
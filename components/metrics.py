@@ -0,0 +1,341 @@
+import atexit
+import bisect
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import streamlit as st
+
+# Seconds; spans a cache hit to a slow model call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic count per label set, e.g. requests or tokens
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        Total over every label set matching the given labels
+        """
+        with self._lock:
+            items = list(self._values.items())
+        return sum(value for key, value in items if self._matches(key, labels))
+
+    def label_values(self, name: str) -> List[str]:
+        """
+        Values seen so far for one label
+        """
+        position = self.labelnames.index(name)
+        with self._lock:
+            return sorted({key[position] for key in self._values})
+
+    def _matches(self, key: Tuple[str, ...], labels: Dict[str, str]) -> bool:
+        return all(key[self.labelnames.index(name)] == str(value) for name, value in labels.items())
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    """
+    Distribution of observed values per label set, in cumulative buckets
+    """
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """
+        Count, sum, mean and bucket-estimated p50/p95 over every label set
+        matching the given labels
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = count = 0
+        with self._lock:
+            for key, (bucket_counts, bucket_sum, bucket_count) in self._values.items():
+                if all(key[self.labelnames.index(name)] == str(value) for name, value in labels.items()):
+                    counts = [a + b for a, b in zip(counts, bucket_counts)]
+                    total += bucket_sum
+                    count += bucket_count
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0.0,
+            "p50": self._quantile(counts, count, 0.5),
+            "p95": self._quantile(counts, count, 0.95)
+        }
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> float:
+        # Linear interpolation inside the bucket holding the quantile
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for position, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if position == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[position - 1] if position else 0.0
+                upper = self.buckets[position]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def expose(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"' if bound == "+Inf" else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Named metrics of the process, exportable in the Prometheus text format
+    """
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SERP_REQUEST_SECONDS = REGISTRY.histogram(
+    "fetchify_serp_request_seconds", "SerpAPI request latency, excluding rate limiter waits", ("outcome",)
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "fetchify_rate_limit_wait_seconds", "Time spent waiting for rate limiter budget", ("limiter",)
+)
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "fetchify_llm_request_seconds", "OpenAI request latency", ("endpoint", "outcome")
+)
+LLM_TOKENS = REGISTRY.counter(
+    "fetchify_llm_tokens_total", "OpenAI tokens used, as reported by the API", ("kind",)
+)
+DB_BATCH_SECONDS = REGISTRY.histogram(
+    "fetchify_db_batch_seconds", "Duration of one PostgreSQL batch read or write", ("operation",)
+)
+DB_ROWS = REGISTRY.counter(
+    "fetchify_db_rows_total", "Rows read or written in PostgreSQL batches", ("operation",)
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "fetchify_cache_lookups_total", "Response cache lookups", ("cache", "result")
+)
+RETRIES = REGISTRY.counter(
+    "fetchify_retries_total", "Requests retried after a throttled or failed attempt", ("provider", "reason")
+)
+CIRCUIT_OPENED = REGISTRY.counter(
+    "fetchify_circuit_opened_total", "Times a provider's circuit breaker opened", ("provider",)
+)
+
+
+def record_llm_usage(response):
+    """
+    Count the tokens an OpenAI response reports using
+    """
+    usage = response.get("usage") if hasattr(response, "get") else None
+    if usage:
+        LLM_TOKENS.inc(usage.get("prompt_tokens", 0), kind="prompt")
+        LLM_TOKENS.inc(usage.get("completion_tokens", 0), kind="completion")
+
+
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_log_handlers: Dict[str, logging.Handler] = {}
+_log_listener: Optional[QueueListener] = None
+_log_lock = threading.Lock()
+_owns_root_level = False
+
+
+def setup_logging(filename: Optional[str] = None, level: int = logging.INFO):
+    """
+    Log to filename (or the console when None) from a background thread.
+
+    The root logger only gets a QueueHandler, so logging calls on the request
+    path never wait on disk or terminal I/O. Its level is only lowered to
+    level if it had no handlers before, so a caller's logging config wins.
+    Safe to call repeatedly; each destination is added once.
+    """
+    global _log_listener, _owns_root_level
+    with _log_lock:
+        destination = filename or "<console>"
+        if destination in _log_handlers:
+            return
+
+        handler = logging.FileHandler(filename) if filename else logging.StreamHandler()
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        _log_handlers[destination] = handler
+
+        # A listener's handlers are fixed, so restart it with the new set
+        if _log_listener is None:
+            atexit.register(_stop_logging)
+        else:
+            _log_listener.stop()
+        _log_listener = QueueListener(_log_queue, *_log_handlers.values(), respect_handler_level=True)
+        _log_listener.start()
+
+        root = logging.getLogger()
+        if not any(isinstance(h, QueueHandler) and h.queue is _log_queue for h in root.handlers):
+            # Like basicConfig, leave the level of a root logger the caller
+            # already configured alone
+            _owns_root_level = not root.handlers
+            root.addHandler(QueueHandler(_log_queue))
+        if _owns_root_level and root.level > level:
+            root.setLevel(level)
+
+
+def _stop_logging():
+    # Flushes the records still queued at exit
+    with _log_lock:
+        if _log_listener is not None:
+            _log_listener.stop()
+
+
+def _format_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+def metrics_panel():
+    """
+    Sidebar summary of where time goes, with a Prometheus export
+    """
+    with st.sidebar.expander("Performance metrics"):
+        serp = SERP_REQUEST_SECONDS.snapshot()
+        serp_errors = SERP_REQUEST_SECONDS.snapshot(outcome="error")["count"]
+        wait = RATE_LIMIT_WAIT_SECONDS.snapshot()
+        llm = LLM_REQUEST_SECONDS.snapshot()
+        db = DB_BATCH_SECONDS.snapshot()
+
+        st.markdown(
+            f"**SerpAPI** {serp['count']} requests ({serp_errors} failed), "
+            f"p50 {_format_seconds(serp['p50'])}, p95 {_format_seconds(serp['p95'])}\n\n"
+            f"**Rate limiter** waited {_format_seconds(wait['sum'])} over {wait['count']} acquires\n\n"
+            f"**LLM** {llm['count']} requests, p50 {_format_seconds(llm['p50'])}, "
+            f"p95 {_format_seconds(llm['p95'])}, "
+            f"{LLM_TOKENS.value(kind='prompt'):.0f} prompt / "
+            f"{LLM_TOKENS.value(kind='completion'):.0f} completion tokens\n\n"
+            f"**Database** {db['count']} batches, {DB_ROWS.value():.0f} rows, "
+            f"p95 {_format_seconds(db['p95'])}"
+        )
+        for cache in CACHE_LOOKUPS.label_values("cache"):
+            hits = CACHE_LOOKUPS.value(cache=cache, result="hit")
+            lookups = hits + CACHE_LOOKUPS.value(cache=cache, result="miss")
+            st.caption(f"Cache {cache}: {hits / lookups:.0%} hit rate over {lookups:.0f} lookups")
+
+        st.download_button(
+            "Prometheus metrics",
+            REGISTRY.to_prometheus(),
+            file_name="fetchify_metrics.prom",
+            mime="text/plain"
+        )
@@ -0,0 +1,204 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from components.cache import ResponseCache
+from components.db import get_connection
+from components.llm import RESULT_TOKEN_BUDGET, extract_records, write_extracted_data
+from components.queryplan import fan_out, normalize_column, plan_rendered_queries, render_queries
+from components.providers import SearchBackend
+from components.scraper import build_serp_pool, open_session
+from components.storeresults import ensure_schema, upsert_search_results
+
+# Tells a stage worker that its input is exhausted; each worker consumes exactly one
+_DONE = object()
+
+
+async def _next_batch(queue: asyncio.Queue, max_items: int) -> Tuple[List, bool]:
+    """
+    Wait for one item, then take whatever else is already queued up to max_items.
+
+    Never waits for a batch to fill up, so the first row flows through at once.
+
+    Returns:
+        The batch and whether this worker's end marker was reached
+    """
+    item = await queue.get()
+    if item is _DONE:
+        return [], True
+
+    batch = [item]
+    while len(batch) < max_items:
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if item is _DONE:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+async def run_pipeline_async(
+    query_template: str,
+    column_name: str,
+    filtered_df: pd.DataFrame,
+    search_concurrency: int = 10,
+    store_concurrency: int = 2,
+    extract_concurrency: int = 4,
+    queue_size: int = 100,
+    store_batch_size: int = 50,
+    extract_batch_size: int = 10,
+    max_prompt_tokens: int = 12000,
+    max_result_tokens: int = RESULT_TOKEN_BUDGET,
+    fast_path_field: Optional[str] = "email",
+    serp_client: Optional[SearchBackend] = None,
+    llm_cache: Optional[ResponseCache] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    missing_values: str = "skip"
+) -> Dict[str, Any]:
+    """
+    Run search -> store -> extract as concurrent stages joined by bounded queues.
+
+    The template and missing_values work as in scrapetheweb: placeholders
+    name columns of filtered_df ({value} is column_name), and every distinct
+    rendered query is searched once. Its results are stored under the
+    column_name value of its first row.
+
+    Every stage has its own number of workers. A full queue blocks the stage
+    feeding it, so a fast search stage cannot run ahead of extraction by more
+    than queue_size rows, and extraction starts as soon as the first search
+    result is stored.
+
+    Returns:
+        Dict with the extracted data and resolving path per input row, the
+        number of distinct queries and per-stage counts
+    """
+    if column_name not in filtered_df.columns:
+        raise ValueError(f"Column '{column_name}' not found in DataFrame")
+
+    if serp_client is None:
+        serp_client = build_serp_pool('serp_rate_limit.json', ResponseCache('search_results.db'))
+    if llm_cache is None:
+        llm_cache = ResponseCache("llm_cache.db", table="llm_cache", ttl=None)
+
+    rendered = render_queries(filtered_df, query_template, column_name, missing_values)
+    first_rows, row_to_query = plan_rendered_queries(rendered)
+    queries: List[str] = rendered.take(first_rows).tolist()
+    # The entity each query is about, stored and extracted as company_name
+    values: List[str] = normalize_column(filtered_df[column_name]).take(first_rows).fillna("").tolist()
+
+    search_queue: asyncio.Queue = asyncio.Queue(queue_size)
+    store_queue: asyncio.Queue = asyncio.Queue(queue_size)
+    extract_queue: asyncio.Queue = asyncio.Queue(queue_size)
+
+    # query index -> (extracted_data, resolved_by)
+    extracted: Dict[int, Tuple] = {}
+    counts = {"searched": 0, "stored": 0, "extracted": 0}
+
+    def finish(index: int, extracted_data, resolved_by):
+        extracted[index] = (extracted_data, resolved_by)
+        if progress_callback is not None:
+            progress_callback(len(extracted), len(queries))
+
+    def prepare():
+        with get_connection() as connection:
+            ensure_schema(connection)
+
+    def store(batch: List[Tuple]) -> List[Tuple]:
+        with get_connection() as connection:
+            return upsert_search_results(connection, batch)
+
+    def write(updates: List[Tuple]):
+        with get_connection() as connection:
+            write_extracted_data(connection, updates)
+
+    async def feed():
+        for index in range(len(queries)):
+            await search_queue.put(index)
+        for _ in range(search_concurrency):
+            await search_queue.put(_DONE)
+
+    async def search_worker(session):
+        while True:
+            index = await search_queue.get()
+            if index is _DONE:
+                return
+            result = await serp_client.search_async(session, queries[index])
+            counts["searched"] += 1
+            if result is None:
+                finish(index, None, None)
+            else:
+                await store_queue.put((index, result))
+
+    async def store_worker():
+        while True:
+            batch, finished = await _next_batch(store_queue, store_batch_size)
+            if batch:
+                rows = await asyncio.to_thread(store, [(values[index], result) for index, result in batch])
+                counts["stored"] += len(rows)
+                # Queries about the same company share its filtered_db row
+                stored = {company_name: (record_id, extracted_data) for record_id, company_name, extracted_data in rows}
+                for index, result in batch:
+                    record_id, extracted_data = stored[values[index]]
+                    if extracted_data:
+                        # Same results as an earlier run, already extracted
+                        finish(index, extracted_data, "stored")
+                    else:
+                        await extract_queue.put((index, (record_id, values[index], result)))
+            if finished:
+                return
+
+    async def extract_worker():
+        while True:
+            batch, finished = await _next_batch(extract_queue, extract_batch_size)
+            if batch:
+                records = list({record[0]: record for _, record in batch}.values())
+                answers = await asyncio.to_thread(
+                    extract_records, records, extract_batch_size, max_prompt_tokens,
+                    max_result_tokens, fast_path_field, llm_cache
+                )
+                updates = [
+                    (record_id, *answers[record_id])
+                    for record_id, _, _ in records if answers[record_id][0]
+                ]
+                await asyncio.to_thread(write, updates)
+                counts["extracted"] += len(updates)
+                for index, (record_id, _, _) in batch:
+                    finish(index, *answers[record_id])
+            if finished:
+                return
+
+    async def close_after(workers: List[asyncio.Task], queue: asyncio.Queue, consumers: int):
+        await asyncio.gather(*workers)
+        for _ in range(consumers):
+            await queue.put(_DONE)
+
+    await asyncio.to_thread(prepare)
+
+    # A failing stage cancels the others instead of leaving them blocked on a full queue
+    async with open_session(search_concurrency) as session:
+        async with asyncio.TaskGroup() as group:
+            searchers = [group.create_task(search_worker(session)) for _ in range(search_concurrency)]
+            storers = [group.create_task(store_worker()) for _ in range(store_concurrency)]
+            for _ in range(extract_concurrency):
+                group.create_task(extract_worker())
+            group.create_task(feed())
+            group.create_task(close_after(searchers, store_queue, store_concurrency))
+            group.create_task(close_after(storers, extract_queue, extract_concurrency))
+
+    distinct = [extracted.get(index, (None, None)) for index in range(len(queries))]
+    return {
+        "results": fan_out([extracted_data for extracted_data, _ in distinct], row_to_query),
+        "resolved_by": fan_out([resolved_by for _, resolved_by in distinct], row_to_query),
+        "distinct_queries": len(queries),
+        "stage_counts": counts
+    }
+
+
+def run_pipeline(*args, **kwargs) -> Dict[str, Any]:
+    """
+    Blocking wrapper around run_pipeline_async for scripts and the Streamlit page
+    """
+    return asyncio.run(run_pipeline_async(*args, **kwargs))
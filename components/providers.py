@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import threading
+from time import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SearchBackend:
+    """
+    Interface of a search provider: one query in, one JSON response (or None) out.
+
+    Backends rate limit and retry on their own; rate_limiter is only read by
+    the pool to see how soon a backend has budget.
+    """
+    name = "backend"
+    rate_limiter = None
+
+    def search(self, query: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def search_async(self, session, query: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+
+def key_id(api_key: str) -> str:
+    """
+    Short stable id of an API key, safe to use in file names, logs and metrics
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def api_keys_from_env(var: str = "SERP_API_KEYS", fallback: str = "SERP_API_KEY") -> List[Tuple[str, float]]:
+    """
+    (key, weight) pairs from a comma separated list such as "key1,key2:2",
+    where the optional weight is the key's quota relative to the others,
+    e.g. 2 for a plan with twice the searches. Falls back to the single key
+    in fallback.
+    """
+    raw = os.getenv(var) or os.getenv(fallback) or ""
+    keys = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, weight = item.partition(":")
+        keys.append((key.strip(), float(weight) if weight else 1.0))
+    return keys
+
+
+class PoolEntry:
+    """
+    A backend and its load and health in the pool
+    """
+    def __init__(self, backend: SearchBackend, weight: float = 1.0):
+        self.backend = backend
+        self.weight = weight
+        self.in_flight = 0
+        self.served = 0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def score(self) -> float:
+        """
+        Estimated seconds until this entry could start one more request:
+        its limiter's wait plus the requests already queued on it, spread
+        over its rate. Backends without a limiter are spread by weight.
+        """
+        limiter = self.backend.rate_limiter
+        if limiter is None:
+            return self.in_flight / self.weight
+        return limiter.time_until_available() + self.in_flight / (limiter.max_per_second or 1)
+
+
+class ProviderPool(SearchBackend):
+    """
+    Dispatches each query to the entry that can serve it soonest.
+
+    Every entry has its own limiter, so throughput grows with the number of
+    keys. An entry whose requests keep failing is taken out of rotation for
+    cooldown seconds, and a failed query is retried once on another entry.
+    """
+    name = "pool"
+
+    def __init__(
+        self,
+        backends: Sequence[SearchBackend],
+        weights: Optional[Sequence[float]] = None,
+        unhealthy_after: int = 3,
+        cooldown: float = 60.0,
+        failover: int = 1
+    ):
+        if not backends:
+            raise ValueError("A provider pool needs at least one backend")
+        weights = weights or [1.0] * len(backends)
+        self.entries = [PoolEntry(backend, weight) for backend, weight in zip(backends, weights)]
+        self.unhealthy_after = unhealthy_after
+        self.cooldown = cooldown
+        self.failover = failover
+        self._lock = threading.Lock()
+
+    def _checkout(self, exclude: List[PoolEntry]) -> Optional[PoolEntry]:
+        with self._lock:
+            now = time()
+            candidates = [entry for entry in self.entries if entry not in exclude]
+            # With every entry cooling down, the least bad one still beats failing the query
+            healthy = [entry for entry in candidates if entry.unhealthy_until <= now]
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+            entry = min(candidates, key=PoolEntry.score)
+            entry.in_flight += 1
+            return entry
+
+    def _checkin(self, entry: PoolEntry, ok: bool):
+        with self._lock:
+            entry.in_flight -= 1
+            if ok:
+                entry.served += 1
+                entry.failures = 0
+                entry.unhealthy_until = 0.0
+                return
+            entry.failures += 1
+            if entry.failures >= self.unhealthy_after and entry.unhealthy_until <= time():
+                entry.unhealthy_until = time() + self.cooldown
+                logger.warning(
+                    f"Taking {entry.backend.name} out of rotation for {self.cooldown:.0f}s "
+                    f"after {entry.failures} failed queries"
+                )
+
+    def search(self, query: str) -> Optional[Dict]:
+        tried: List[PoolEntry] = []
+        for _ in range(1 + self.failover):
+            entry = self._checkout(tried)
+            if entry is None:
+                break
+            result = None
+            try:
+                result = entry.backend.search(query)
+            finally:
+                self._checkin(entry, result is not None)
+            if result is not None:
+                return result
+            tried.append(entry)
+        return None
+
+    async def search_async(self, session, query: str) -> Optional[Dict]:
+        tried: List[PoolEntry] = []
+        for _ in range(1 + self.failover):
+            entry = self._checkout(tried)
+            if entry is None:
+                break
+            result = None
+            try:
+                result = await entry.backend.search_async(session, query)
+            finally:
+                self._checkin(entry, result is not None)
+            if result is not None:
+                return result
+            tried.append(entry)
+        return None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Served and failed queries and health of every entry
+        """
+        now = time()
+        with self._lock:
+            return [
+                {
+                    "name": entry.backend.name,
+                    "weight": entry.weight,
+                    "served": entry.served,
+                    "failures": entry.failures,
+                    "in_flight": entry.in_flight,
+                    "healthy": entry.unhealthy_until <= now
+                }
+                for entry in self.entries
+            ]
@@ -0,0 +1,150 @@
+import re
+import string
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+
+def fan_out(distinct_results: List, row_to_query: List[Optional[int]]) -> List:
+    """
+    Map the results fetched for each distinct query back onto every matching
+    row; rows without a query (None) get None
+    """
+    return [distinct_results[index] if index is not None else None for index in row_to_query]
+
+
+# Strings in Arrow memory, so the column operations below run in C
+STRING = pd.StringDtype("pyarrow")
+
+# Whitespace that is not already a single space; cheaper to scan for than \s+
+_UNNORMALIZED_WHITESPACE = r"\s\s+|[^\S ]"
+
+# What to do with a row whose placeholder column is empty: leave the row
+# unsearched, search with the placeholder left out, or refuse the template
+MISSING_VALUE_POLICIES = ("skip", "empty", "error")
+
+
+def template_fields(query_template: str) -> List[str]:
+    """
+    Placeholder names of a template such as "{company} {city} contact email",
+    in order of first use. Only plain {name} placeholders are accepted.
+    """
+    try:
+        parsed = list(string.Formatter().parse(query_template))
+    except ValueError as e:
+        raise ValueError(f"Invalid query template: {e}") from e
+
+    fields: List[str] = []
+    for _, field, format_spec, conversion in parsed:
+        if field is None:
+            continue
+        if not field:
+            raise ValueError("Name every placeholder after a column, e.g. {company}; {} is not supported")
+        if format_spec or conversion:
+            raise ValueError(f"Placeholder {{{field}}} may not have a format spec or conversion")
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def template_columns(columns: Iterable, query_template: str, column_name: Optional[str] = None) -> Dict[str, str]:
+    """
+    Validate the template's placeholders against the frame's columns once.
+
+    {value} stands for column_name, as in single-column templates; any other
+    placeholder must be a column name.
+
+    Returns:
+        The column each placeholder is filled from
+    """
+    columns = set(columns)
+    fields = template_fields(query_template)
+    if not fields:
+        raise ValueError("Query template must contain a placeholder, e.g. {value} or a column name like {company}")
+
+    mapping = {}
+    unknown = []
+    for field in fields:
+        column = column_name if field == "value" and column_name is not None else field
+        if column in columns:
+            mapping[field] = column
+        else:
+            unknown.append(field)
+    if unknown:
+        raise ValueError(
+            f"Query template refers to unknown columns: {', '.join(unknown)}. "
+            f"Available columns: {', '.join(map(str, sorted(columns, key=str)))}"
+        )
+    return mapping
+
+
+def normalize_column(values: pd.Series) -> pd.Series:
+    """
+    Strip and collapse whitespace in every cell of a column before it is
+    rendered into a query; blank cells become missing (NA)
+    """
+    text = values.astype(STRING).str.replace(_UNNORMALIZED_WHITESPACE, " ", regex=True).str.strip()
+    return text.mask(text.eq("").fillna(True).astype(bool))
+
+
+def render_queries(
+    frame: pd.DataFrame,
+    query_template: str,
+    column_name: Optional[str] = None,
+    missing: str = "skip"
+) -> pd.Series:
+    """
+    Render the template for every row in one vectorized pass over the
+    columns it refers to.
+
+    A row with a missing value in any of those columns is handled by the
+    missing policy: "skip" leaves it without a query (NA), "empty" renders
+    the placeholder as nothing, and "error" raises a ValueError naming the
+    first such rows.
+
+    Returns:
+        Whitespace-normalized queries, aligned with the frame's index
+    """
+    if missing not in MISSING_VALUE_POLICIES:
+        raise ValueError(f"Unknown missing value policy '{missing}', expected one of {', '.join(MISSING_VALUE_POLICIES)}")
+    mapping = template_columns(frame.columns, query_template, column_name)
+    fields = {field: normalize_column(frame[column]) for field, column in mapping.items()}
+
+    absent = pd.Series(False, index=frame.index)
+    for values in fields.values():
+        absent |= values.isna()
+    if missing == "error" and absent.any():
+        rows = ", ".join(map(str, frame.index[absent][:5]))
+        raise ValueError(f"{int(absent.sum())} rows have no value for a placeholder, e.g. rows {rows}")
+
+    # Values and literals are normalized separately, so whole queries only
+    # need stripping, and collapsing where an empty placeholder left a gap
+    rendered = pd.Series("", index=frame.index, dtype=STRING)
+    for literal, field, _, _ in string.Formatter().parse(query_template):
+        if literal:
+            rendered = rendered + re.sub(r"\s+", " ", literal)
+        if field is not None:
+            rendered = rendered + fields[field].fillna("")
+    if missing == "empty" and absent.any():
+        rendered[absent] = rendered[absent].str.replace(r"\s+", " ", regex=True)
+    rendered = rendered.str.strip()
+
+    if missing == "skip":
+        rendered = rendered.mask(absent)
+    return rendered
+
+
+def plan_rendered_queries(rendered: pd.Series) -> Tuple[List[int], List[Optional[int]]]:
+    """
+    plan_queries for queries rendered by render_queries: one search per
+    distinct query, ignoring case, with rows without a query left out.
+
+    Returns:
+        The position of each distinct query's first row (whose spelling is
+        searched) and, for every row, the index of its distinct query or None
+    """
+    codes, _ = pd.factorize(rendered.str.lower(), use_na_sentinel=True)
+    positions = pd.Series(codes).drop_duplicates()
+    first_rows = positions.index[positions.to_numpy() >= 0].tolist()
+    row_to_query = [code if code >= 0 else None for code in codes.tolist()]
+    return first_rows, row_to_query
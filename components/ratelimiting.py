@@ -1,82 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
 from time import sleep, time
-from datetime import datetime, timedelta
-from collections import deque
+from typing import Dict, Optional
+
+from components.metrics import RATE_LIMIT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
 
 class RateLimiter:
     """
-    Custom rate limiter using deque for tracking requests
+    GCRA (token bucket) rate limiter over several windows.
+
+    Each window keeps a single theoretical arrival time, so memory stays
+    constant no matter how large the limits are. A window allows a burst of up
+    to its full limit and then refills at limit/period.
     """
-    def __init__(self, max_per_second=1, max_per_day=100):
+    def __init__(
+        self,
+        max_per_second: Optional[float] = 1,
+        max_per_day: Optional[float] = 100,
+        max_per_minute: Optional[float] = None,
+        state_path: Optional[str] = None,
+        name: str = "serpapi"
+    ):
+        self.name = name
         self.max_per_second = max_per_second
+        self.max_per_minute = max_per_minute
         self.max_per_day = max_per_day
-        self.seconds_tracker = deque(maxlen=max_per_second)
-        self.daily_tracker = deque(maxlen=max_per_day)
-    
-    def wait_if_needed(self):
+        self.state_path = state_path
+
+        # window length in seconds -> allowed requests per window
+        self.windows: Dict[int, float] = {}
+        for period, limit in ((1, max_per_second), (60, max_per_minute), (86400, max_per_day)):
+            if limit:
+                self.windows[period] = limit
+
+        # Theoretical arrival time per window, in wall-clock seconds so it survives restarts
+        self._tat: Dict[int, float] = {period: 0.0 for period in self.windows}
+        # Wall-clock time before which nothing is allowed, set when the provider throttles us
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._load_state()
+
+    def _delay(self, now: float, cost: float) -> float:
         """
-        Check limits and wait if necessary
+        Seconds until cost requests fit in every window. Caller must hold the lock.
         """
-        now = time()
-        current_datetime = datetime.now()
-        
-        # Clean old entries from daily tracker
-        while self.daily_tracker and \
-              (current_datetime - self.daily_tracker[0]).total_seconds() > 86400:  # 24 hours
-            self.daily_tracker.popleft()
-        
-        # Clean old entries from seconds tracker
-        while self.seconds_tracker and now - self.seconds_tracker[0] > 1:
-            self.seconds_tracker.popleft()
-        
-        # Check daily limit
-        if len(self.daily_tracker) >= self.max_per_day:
-            oldest = self.daily_tracker[0]
-            sleep_time = 86400 - (current_datetime - oldest).total_seconds()
-            if sleep_time > 0:
-                sleep(sleep_time)
-        
-        # Check per-second limit
-        if len(self.seconds_tracker) >= self.max_per_second:
-            sleep_time = 1 - (now - self.seconds_tracker[0])
-            if sleep_time > 0:
-                sleep(sleep_time)
-        
-        # Log the request
-        self.seconds_tracker.append(now)
-        self.daily_tracker.append(current_datetime)
-
-'''class RateLimiter:
-    def __init__(self, max_per_second=1, max_per_day=100):
-        self.max_per_second = max_per_second
-        self.max_per_day = max_per_day
-        self.seconds_tracker = deque(maxlen=max_per_second)
-        self.daily_tracker = deque(maxlen=max_per_day)
-    
-    def wait_if_needed(self):
-        now = time()
-        current_datetime = datetime.now()
-        
-        # Clean old entries
-        while self.daily_tracker and \
-              (current_datetime - self.daily_tracker[0]).total_seconds() > 86400:
-            self.daily_tracker.popleft()
-        
-        while self.seconds_tracker and now - self.seconds_tracker[0] > 1:
-            self.seconds_tracker.popleft()
-        
-        # Check limits and wait if needed
-        if len(self.daily_tracker) >= self.max_per_day:
-            oldest = self.daily_tracker[0]
-            sleep_time = 86400 - (current_datetime - oldest).total_seconds()
-            if sleep_time > 0:
-                sleep(sleep_time)
-        
-        if len(self.seconds_tracker) >= self.max_per_second:
-            sleep_time = 1 - (now - self.seconds_tracker[0])
-            if sleep_time > 0:
-                sleep(sleep_time)
-        
-        # Log the request
-        self.seconds_tracker.append(now)
-        self.daily_tracker.append(current_datetime)
-'''
\ No newline at end of file
+        delay = max(self._blocked_until - now, 0.0)
+        for period, limit in self.windows.items():
+            if cost > limit:
+                raise ValueError(f"Cost {cost} exceeds the limit of {limit} per {period}s")
+            new_tat = max(self._tat[period], now) + cost * period / limit
+            delay = max(delay, new_tat - period - now)
+        return delay
+
+    def _commit(self, now: float, cost: float):
+        for period, limit in self.windows.items():
+            self._tat[period] = max(self._tat[period], now) + cost * period / limit
+        self._save_state()
+
+    def penalize(self, seconds: float):
+        """
+        Hold off every caller for seconds, e.g. after a 429 with Retry-After,
+        without spending any window's budget
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time() + seconds)
+            self._save_state()
+
+    def time_until_available(self, cost: float = 1) -> float:
+        """
+        Seconds to wait before cost requests would be allowed, without reserving them
+        """
+        with self._lock:
+            return self._delay(time(), cost)
+
+    def try_acquire(self, cost: float = 1) -> bool:
+        """
+        Take cost requests from every window if they all have budget, without blocking
+        """
+        with self._lock:
+            now = time()
+            if self._delay(now, cost) > 0:
+                return False
+            self._commit(now, cost)
+            return True
+
+    def wait_if_needed(self, cost: float = 1):
+        """
+        Block the calling thread until cost requests are allowed, then take them
+        """
+        start = time()
+        while True:
+            with self._lock:
+                now = time()
+                delay = self._delay(now, cost)
+                if delay <= 0:
+                    self._commit(now, cost)
+                    RATE_LIMIT_WAIT_SECONDS.observe(now - start, limiter=self.name)
+                    return
+            sleep(delay)
+
+    async def acquire(self, cost: float = 1):
+        """
+        Wait on the event loop until cost requests are allowed, then take them
+        """
+        start = time()
+        while True:
+            with self._lock:
+                now = time()
+                delay = self._delay(now, cost)
+                if delay <= 0:
+                    self._commit(now, cost)
+                    RATE_LIMIT_WAIT_SECONDS.observe(now - start, limiter=self.name)
+                    return
+            await asyncio.sleep(delay)
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        for period, tat in state.get("tat", {}).items():
+            if int(period) in self._tat:
+                self._tat[int(period)] = float(tat)
+        self._blocked_until = float(state.get("blocked_until", 0.0))
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        # Write a temporary file of our own, then rename it, so a crash never
+        # leaves a half-written state file and concurrent writers never share one
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".ratelimit-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"tat": self._tat, "blocked_until": self._blocked_until}, f)
+                os.replace(tmp_path, self.state_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        except OSError as e:
+            # The in-memory budget stays correct; only a restart would lose it
+            logger.warning(f"Could not save rate limiter state to {self.state_path}: {e}")
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(state_path: str, **kwargs) -> RateLimiter:
+    """
+    One limiter per state file, shared by every job in the process.
+
+    Separate limiters on one file would each load the budget once and spend
+    it in full, so the file's quota must only ever be spent through this one.
+    The limits of the first caller apply.
+    """
+    key = os.path.abspath(state_path)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(state_path=state_path, **kwargs)
+        return _limiters[key]
@@ -0,0 +1,257 @@
+import asyncio
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from time import sleep, time
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, TypeVar
+
+import aiohttp
+import openai
+import requests
+
+from components.metrics import CIRCUIT_OPENED, RETRIES
+
+T = TypeVar("T")
+
+
+class Failure(NamedTuple):
+    """
+    How a failed call should be handled
+    """
+    retryable: bool
+    # The provider asked us to slow down (429), as opposed to failing
+    throttled: bool = False
+    retry_after: Optional[float] = None
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    Seconds from a Retry-After header, given as delta-seconds or an HTTP date
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(headers) -> Optional[float]:
+    # Header mappings differ between clients, not all are case-insensitive
+    for name, value in (headers or {}).items():
+        if name.lower() == "retry-after":
+            return parse_retry_after(value)
+    return None
+
+
+def _from_status(status: int, headers) -> Failure:
+    if status == 429:
+        return Failure(True, throttled=True, retry_after=_retry_after(headers))
+    if status in (408, 425) or status >= 500:
+        return Failure(True, retry_after=_retry_after(headers))
+    return Failure(False)
+
+
+def classify_http_error(error: Exception) -> Failure:
+    """
+    Classify requests and aiohttp errors: 429, 408 and 5xx responses,
+    timeouts and dropped connections are worth retrying, other errors are not
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return _from_status(error.response.status_code, error.response.headers)
+    if isinstance(error, aiohttp.ClientResponseError):
+        return _from_status(error.status, error.headers)
+    if isinstance(error, (requests.ConnectionError, requests.Timeout,
+                          aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return Failure(True)
+    return Failure(False)
+
+
+def classify_openai_error(error: Exception) -> Failure:
+    """
+    Classify openai errors the same way as classify_http_error
+    """
+    if isinstance(error, openai.error.OpenAIError):
+        retry_after = _retry_after(error.headers)
+        if isinstance(error, openai.error.RateLimitError):
+            return Failure(True, throttled=True, retry_after=retry_after)
+        if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError,
+                              openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+            return Failure(True, retry_after=retry_after)
+        if isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500:
+            return Failure(True, retry_after=retry_after)
+    return Failure(False)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, never shorter than a Retry-After the
+    provider sent
+    """
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a provider that keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and
+    callers wait instead of sending requests. After reset_timeout seconds a
+    single probe is let through: success closes the circuit, failure opens
+    it for another reset_timeout.
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def time_until_allowed(self) -> float:
+        """
+        0 when the caller may send a request now (possibly as the probe),
+        otherwise seconds to wait before asking again
+        """
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_timeout - time()
+                if remaining > 0:
+                    return remaining
+                self.state = "half_open"
+                return 0.0
+            # A probe is in flight; check back shortly
+            return min(1.0, self.reset_timeout)
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time()
+                CIRCUIT_OPENED.inc(provider=self.name)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str, **kwargs) -> CircuitBreaker:
+    """
+    One breaker per provider, shared by every client in the process
+    """
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider, **kwargs)
+        return _breakers[provider]
+
+
+def _after_failure(
+    error: Exception,
+    attempt: int,
+    classify: Callable[[Exception], Failure],
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker],
+    rate_limiter,
+    provider: str
+) -> float:
+    """
+    Update the breaker and limiter for a failed attempt and return the delay
+    before the next one; re-raises when the call should not be retried
+    """
+    failure = classify(error)
+    if breaker is not None:
+        # Throttling and client errors still prove the provider is up
+        if failure.retryable and not failure.throttled:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    if not failure.retryable or attempt + 1 >= policy.max_attempts:
+        raise error
+
+    RETRIES.inc(provider=provider, reason="throttled" if failure.throttled else "error")
+    delay = policy.backoff(attempt, failure.retry_after)
+    if failure.throttled and rate_limiter is not None:
+        # Every caller sharing the limiter holds off, not just this one;
+        # the next attempt waits for the limiter instead of sleeping here
+        rate_limiter.penalize(delay)
+        return 0.0
+    return delay
+
+
+def call_with_retry(
+    func: Callable[[], T],
+    classify: Callable[[Exception], Failure],
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    rate_limiter=None,
+    provider: str = "serpapi"
+) -> T:
+    """
+    Call func until it succeeds, a non-retryable error occurs or the policy's
+    attempts run out, waiting while the breaker is open
+    """
+    attempt = 0
+    while True:
+        if breaker is not None:
+            while (wait := breaker.time_until_allowed()) > 0:
+                sleep(wait)
+        try:
+            result = func()
+        except Exception as e:
+            delay = _after_failure(e, attempt, classify, policy, breaker, rate_limiter, provider)
+            attempt += 1
+            sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+async def call_with_retry_async(
+    func: Callable[[], Awaitable[T]],
+    classify: Callable[[Exception], Failure],
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    rate_limiter=None,
+    provider: str = "serpapi"
+) -> T:
+    """
+    call_with_retry for coroutines; waits on the event loop
+    """
+    attempt = 0
+    while True:
+        if breaker is not None:
+            while (wait := breaker.time_until_allowed()) > 0:
+                await asyncio.sleep(wait)
+        try:
+            result = await func()
+        except Exception as e:
+            delay = _after_failure(e, attempt, classify, policy, breaker, rate_limiter, provider)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
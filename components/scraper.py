@@ -1,5 +1,7 @@
+import asyncio
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
+import aiohttp
 import pandas as pd
 import requests
 import streamlit as st
@@ -7,75 +9,475 @@ from time import sleep, time
 from datetime import datetime, timedelta
 from collections import deque
 import os
-from ratelimiting import RateLimiter
+from components.cache import ResponseCache, serp_cache_key
+from components.export import ExportStream
+from components.fingerprints import FingerprintStore, row_fingerprints
+from components.jobs import JobStore, job_id_for
+from components.metrics import SERP_REQUEST_SECONDS, setup_logging
+from components.providers import ProviderPool, SearchBackend, api_keys_from_env, key_id
+from components.queryplan import (
+    fan_out, normalize_column, plan_rendered_queries, render_queries, template_columns
+)
+from components.ratelimiting import RateLimiter, get_rate_limiter
+from components.retry import (
+    CircuitBreaker, RetryPolicy, call_with_retry, call_with_retry_async, classify_http_error, get_breaker
+)
+
+# Overridable to point the scraper at a local stand-in, e.g. for the benchmarks
+SERP_API_URL = os.getenv("SERP_API_URL", "https://api.serpapi.com/search")
+
+# Fingerprints of new rows are written this many at a time while results arrive
+FINGERPRINT_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+class SerpClient(SearchBackend):
+    """
+    SerpAPI client that checks the response cache before spending rate-limited quota.
+
+    Throttled (429), timed-out and 5xx requests are retried with jittered
+    backoff, and a 429's Retry-After pauses the shared rate limiter. A
+    circuit breaker per API key, shared by every client using that key,
+    pauses its requests while SerpAPI keeps failing for it.
+    """
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        cache: Optional[ResponseCache] = None,
+        on_error: Optional[Callable[[Exception, str], None]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.api_key = api_key or os.getenv('SERP_API_KEY')
+        if not self.api_key:
+            raise ValueError("SERP_API_KEY not found in environment variables")
+        self.name = f"serpapi:{key_id(self.api_key)}"
+        self.rate_limiter = rate_limiter or RateLimiter(max_per_second=1, max_per_day=15, name=self.name)
+        self.cache = cache
+        self.on_error = on_error
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Per key, so one revoked or exhausted key does not pause the others
+        self.breaker = breaker or get_breaker(self.name)
+
+    def build_params(self, query: str) -> Dict:
+        return {
+            "api_key": self.api_key,
+            "engine": "google",
+            "q": query,
+            "num": 10,
+            "gl": "us"
+        }
+
+    def _cache_key(self, params: Dict) -> str:
+        return serp_cache_key(params["q"], params["engine"], params["num"], params["gl"])
+
+    def _handle_error(self, err: Exception, query: str):
+        logger.error(f"Error searching for '{query}': {str(err)}")
+        if self.on_error is not None:
+            self.on_error(err, query)
+
+    def search(self, query: str) -> Optional[Dict]:
+        params = self.build_params(query)
+        if self.cache is not None:
+            cached = self.cache.get(self._cache_key(params))
+            if cached is not None:
+                return cached
+
+        def attempt() -> Dict:
+            self.rate_limiter.wait_if_needed()
+            start = time()
+            try:
+                response = requests.get(SERP_API_URL, params=params, timeout=30)
+                response.raise_for_status()  # Raises HTTPError for bad responses
+                result = response.json()
+            except requests.RequestException:
+                SERP_REQUEST_SECONDS.observe(time() - start, outcome="error")
+                raise
+            SERP_REQUEST_SECONDS.observe(time() - start, outcome="ok")
+            return result
+
+        try:
+            result = call_with_retry(
+                attempt, classify_http_error, self.retry_policy, self.breaker, self.rate_limiter
+            )
+        except requests.RequestException as e:
+            self._handle_error(e, query)
+            return None
+
+        if self.cache is not None:
+            self.cache.set(self._cache_key(params), result)
+        return result
+
+    async def search_async(self, session: aiohttp.ClientSession, query: str) -> Optional[Dict]:
+        params = self.build_params(query)
+        if self.cache is not None:
+            cached = self.cache.get(self._cache_key(params))
+            if cached is not None:
+                return cached
+
+        async def attempt() -> Dict:
+            await self.rate_limiter.acquire()
+            start = time()
+            try:
+                async with session.get(SERP_API_URL, params=params) as response:
+                    response.raise_for_status()
+                    result = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                SERP_REQUEST_SECONDS.observe(time() - start, outcome="error")
+                raise
+            SERP_REQUEST_SECONDS.observe(time() - start, outcome="ok")
+            return result
+
+        try:
+            result = await call_with_retry_async(
+                attempt, classify_http_error, self.retry_policy, self.breaker, self.rate_limiter
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._handle_error(e, query)
+            return None
+
+        if self.cache is not None:
+            self.cache.set(self._cache_key(params), result)
+        return result
+
+def build_serp_pool(
+    rate_limit_state: Optional[str] = 'serp_rate_limit.json',
+    cache: Optional[ResponseCache] = None,
+    on_error: Optional[Callable[[Exception, str], None]] = None,
+    max_per_second: float = 1,
+    max_per_day: float = 15
+) -> ProviderPool:
+    """
+    One SerpClient per key in SERP_API_KEYS (or the single SERP_API_KEY),
+    each with its own rate limiter of max_per_second and max_per_day, scaled
+    by the key's weight.
+
+    With several keys every limiter persists to its own file next to
+    rate_limit_state, named after the key's id rather than the key itself.
+    """
+    keys = api_keys_from_env()
+    if not keys:
+        raise ValueError("SERP_API_KEYS or SERP_API_KEY not found in environment variables")
+
+    clients = []
+    for api_key, weight in keys:
+        name = f"serpapi:{key_id(api_key)}"
+        state_path = rate_limit_state
+        if rate_limit_state and len(keys) > 1:
+            root, ext = os.path.splitext(rate_limit_state)
+            state_path = f"{root}-{key_id(api_key)}{ext}"
+        limits = {"max_per_second": max_per_second * weight, "max_per_day": max_per_day * weight, "name": name}
+        # Persisted budgets are shared by every job, so concurrent jobs cannot each spend the full quota
+        limiter = get_rate_limiter(state_path, **limits) if state_path else RateLimiter(**limits)
+        clients.append(SerpClient(api_key, rate_limiter=limiter, cache=cache, on_error=on_error))
+    return ProviderPool(clients, [weight for _, weight in keys])
+
+def open_session(max_concurrency: int = 10) -> aiohttp.ClientSession:
+    """
+    Shared keep-alive session sized for max_concurrency in-flight requests
+    """
+    connector = aiohttp.TCPConnector(limit=max_concurrency, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=30)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
 
 def scrapetheweb(
     query_template: str,
     column_name: str,
     filtered_df: pd.DataFrame,
     export_format: str = 'excel',
-    db_name: str = 'search_results.db',
-    export_path: str = 'export_results'
-) -> Dict[str, List[str]]:
+    db_name: Optional[str] = 'search_results.db',
+    export_path: str = 'export_results',
+    use_async: bool = False,
+    max_concurrency: int = 10,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    result_callback: Optional[Callable[[str, Optional[Dict]], None]] = None,
+    cache_ttl: Optional[float] = 7 * 86400,
+    cache_max_entries: Optional[int] = 100_000,
+    rate_limit_state: Optional[str] = 'serp_rate_limit.json',
+    jobs_db: Optional[str] = 'jobs.db',
+    job_id: Optional[str] = None,
+    retry_failed: bool = False,
+    rate_limiter: Optional[RateLimiter] = None,
+    fingerprints_db: Optional[str] = 'fingerprints.db',
+    fingerprint_max_age: Optional[float] = 7 * 86400,
+    missing_values: str = 'skip',
+    collect_results: bool = True,
+    error_callback: Optional[Callable[[Exception, str], None]] = None
+) -> Dict[str, Any]:
     """
+    Args:
+        query_template: Search query with placeholders naming columns of
+            filtered_df, e.g. "{company} {city} contact email". {value} stands
+            for column_name.
+        column_name: Column holding the entity each row is about; its value
+            is what result_callback and the export report for the row.
+        export_format: One of csv, jsonl, parquet or excel (xlsx). Rows are
+            written in input order while results arrive. Pass None to skip the export.
+        export_path: Directory the export file is written to, named after the job id.
+        db_name: SQLite file used to cache SERP responses. Pass None to disable caching.
+        use_async: Fetch with asyncio over a shared keep-alive session instead
+            of one blocking request per row.
+        max_concurrency: Maximum number of in-flight requests in async mode.
+        progress_callback: Called as ``progress_callback(done, total)`` after
+            each distinct query. Defaults to a Streamlit progress bar.
+        result_callback: Called as ``result_callback(value, result)`` as soon
+            as each distinct value has been searched, for partial results.
+        cache_ttl: Seconds before a cached response is refetched (None keeps it forever).
+            Rows unchanged since an earlier run are reused by fingerprint
+            instead, for fingerprint_max_age, without consulting this cache.
+        cache_max_entries: Least recently used responses are evicted past this size.
+        rate_limit_state: File the rate limiter persists its budget to, so a
+            restart does not reset the daily quota. Pass None to keep it in memory.
+            With several keys in SERP_API_KEYS each key gets its own file and
+            limiter, and queries go to whichever key has budget first.
+        jobs_db: SQLite file that checkpoints which queries are pending, in
+            flight, done or failed. Pass None to keep progress in memory only.
+            Results checkpointed more than cache_ttl ago are fetched again.
+        job_id: Job to create or resume. Defaults to an id derived from the
+            template and rendered queries, so rerunning the same sheet resumes
+            it if it was interrupted, and runs it again if it finished.
+        retry_failed: Also refetch queries that failed in an interrupted run of the job.
+        rate_limiter: Limiter to spend a single SERP_API_KEY's quota from,
+            instead of the per-key pool built from the environment.
+        fingerprints_db: SQLite file with a fingerprint of every row processed
+            before (template, rendered query and column value) and its result.
+            Rows seen in any earlier run are not fetched again, their stored
+            results are merged into this run's. Pass None to process every row.
+        fingerprint_max_age: Seconds after which an unchanged row is fetched
+            again anyway (None keeps its result forever).
+        missing_values: Rows with an empty placeholder column are not
+            searched with 'skip', searched with the placeholder left out with
+            'empty', and rejected up front with 'error'.
+        collect_results: Return every row's result. Callers that only need
+            the export or result_callback pass False, so no response is kept
+            longer than it takes to hand it on and memory does not grow with
+            the number of rows.
+        error_callback: Called as ``error_callback(err, query)`` for each
+            query that could not be searched. Defaults to a Streamlit error,
+            which only shows when called from the script thread.
+
     Returns:
-        Dict containing lists of scraped results and export file paths
+        Dict containing lists of scraped results (in input order, None
+        without collect_results), export file paths, cache statistics, the
+        number of distinct queries sent, the number of rows reused from
+        earlier runs and the job id
     """
     
-    # Set up logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('scraping.log'),
-            logging.StreamHandler()
-        ]
-    )
-    logger = logging.getLogger(__name__)
+    # Set up logging; records are written from a background thread. The
+    # console is left to the application
+    setup_logging('scraping.log')
     
     # Validate inputs
     if column_name not in filtered_df.columns:
         raise ValueError(f"Column '{column_name}' not found in DataFrame")
-    if '{value}' not in query_template:
-        raise ValueError("Query template must contain {value} placeholder")
+    placeholders = template_columns(filtered_df.columns, query_template, column_name)
     
-    # Initialize rate limiter
-    rate_limiter = RateLimiter(max_per_second=1, max_per_day=15)
+    # Responses are cached on disk so reruns over the same sheet use no quota
+    cache = None
+    if db_name:
+        cache = ResponseCache(db_name, ttl=cache_ttl, max_entries=cache_max_entries)
     
-    # SERP API setup
-    SERP_API_KEY = os.getenv('SERP_API_KEY')
-    if not SERP_API_KEY:
-        raise ValueError("SERP_API_KEY not found in environment variables")
-    
-    SERP_API_URL = "https://api.serpapi.com/search"
-    
-    def handle_api_errors(err: Exception, value: str):
-        """Handles API errors by logging and displaying a message in Streamlit."""
-        logger.error(f"Error searching for '{value}': {str(err)}")
-        st.error(f"An error occurred while searching for '{value}': {str(err)}")
-
-    def search_serp(value: str) -> Optional[Dict]:
-        rate_limiter.wait_if_needed()
-        
-        # Replace placeholder in query template
-        search_query = query_template.format(value=value)
-        
-        params = {
-            "api_key": SERP_API_KEY,
-            "engine": "google",
-            "q": search_query,
-            "num": 10,
-            "gl": "us"
+    def handle_api_errors(err: Exception, query: str):
+        """Displays API errors in Streamlit; SerpClient has already logged them."""
+        st.error(f"An error occurred while searching for '{query}': {str(err)}")
+
+    if error_callback is None:
+        error_callback = handle_api_errors
+
+    # Each key brings its own 1/s, 15/day budget; more keys means more throughput
+    if rate_limiter is None:
+        client = build_serp_pool(rate_limit_state, cache, error_callback)
+    else:
+        client = SerpClient(rate_limiter=rate_limiter, cache=cache, on_error=error_callback)
+
+    def deliver(index: int, result: Optional[Dict]):
+        # Hand a query's result on; it is only kept when collecting
+        if result is not None:
+            found[index] = 1
+            if store is not None and index not in reused:
+                unrecorded.extend((fingerprint, queries[index], result) for fingerprint in new_rows.pop(index, ()))
+                if len(unrecorded) >= FINGERPRINT_BATCH:
+                    store.record(unrecorded)
+                    unrecorded.clear()
+        if distinct_results is not None:
+            distinct_results[index] = result
+        if result_callback is not None:
+            result_callback(values[index], result)
+        if export is not None:
+            export.add(index, result)
+
+    def record(index: int, result: Optional[Dict]):
+        deliver(index, result)
+        if jobs is not None:
+            if result is None:
+                jobs.mark_failed(job_id, index)
+            else:
+                jobs.mark_done(job_id, index, result)
+
+    def search_serp(index: int) -> Optional[Dict]:
+        if jobs is not None:
+            jobs.mark_in_flight(job_id, index)
+        result = client.search(queries[index])
+        record(index, result)
+        return result
+
+    async def search_all_async(todo: List[int]):
+        done = len(values) - len(todo)
+        # Workers share one iterator, so there are max_concurrency tasks
+        # however many queries are left
+        remaining = iter(todo)
+
+        async with open_session(max_concurrency) as session:
+
+            async def worker():
+                nonlocal done
+                for index in remaining:
+                    if jobs is not None:
+                        jobs.mark_in_flight(job_id, index)
+                    result = await client.search_async(session, queries[index])
+                    record(index, result)
+                    done += 1
+                    progress_callback(done, len(values))
+
+            await asyncio.gather(*(worker() for _ in range(max_concurrency)))
+
+    if progress_callback is None:
+        progress_bar = st.progress(0.0)
+
+        def progress_callback(done: int, total: int):
+            progress_bar.progress(done / total, text=f"Searched {done}/{total}")
+
+    # Render every row's query in one pass, then fetch each distinct query
+    # once and fan the results back out to every row
+    rendered = render_queries(filtered_df, query_template, column_name, missing_values)
+    first_rows, row_to_query = plan_rendered_queries(rendered)
+    queries: List[str] = rendered.take(first_rows).tolist()
+    # The entity each query is about, as reported to result_callback
+    values: List[str] = normalize_column(filtered_df[column_name]).take(first_rows).fillna("").tolist()
+    skipped = sum(index is None for index in row_to_query)
+    if skipped:
+        logger.info(f"Skipping {skipped} rows with an empty placeholder value")
+    if not queries:
+        return {
+            "results": [],
+            "export_files": [],
+            "cache_stats": cache.stats() if cache else {},
+            "distinct_queries": 0,
+            "reused_rows": 0,
+            "job_id": job_id
         }
-        
-        try:
-            response = requests.get(SERP_API_URL, params=params)
-            response.raise_for_status()  # Raises HTTPError for bad responses
-            return response.json()
-        
-        except requests.RequestException as e:
-            handle_api_errors(e, value)
-            return None
 
+    # Rows fingerprinted by an earlier run keep their result; only new and
+    # changed rows are fetched. Only the query keys are looked up here, the
+    # results are read back a chunk at a time below.
+    fingerprints: List[str] = []
+    reused: Dict[int, str] = {}
+    # Fingerprints of the rows that are not reused, by query, recorded with
+    # the query's result as soon as it arrives
+    new_rows: Dict[int, List[str]] = {}
+    unrecorded: List[tuple] = []
+    store = FingerprintStore(fingerprints_db, fingerprint_max_age) if fingerprints_db else None
+    if store is not None:
+        fingerprints = row_fingerprints(
+            query_template,
+            rendered,
+            {column: normalize_column(filtered_df[column]) for column in dict.fromkeys(placeholders.values())}
+        )
+        known = store.lookup_queries(fingerprints)
+        for row, fingerprint in enumerate(fingerprints):
+            if fingerprint in known:
+                reused.setdefault(row_to_query[row], known[fingerprint])
+        for row, fingerprint in enumerate(fingerprints):
+            if fingerprint is not None and row_to_query[row] not in reused:
+                new_rows.setdefault(row_to_query[row], []).append(fingerprint)
+
+    found = bytearray(len(values))
+    distinct_results: Optional[List[Optional[Dict]]] = [None] * len(values) if collect_results else None
+    job_id = job_id or job_id_for(query_template, queries)
+    jobs = JobStore(jobs_db) if jobs_db else None
+    export = None
+    export_files: List[str] = []
+    try:
+        # Rows are streamed to the export file in input order as their results come in
+        if export_format:
+            export = ExportStream(
+                export_format,
+                export_path,
+                f"results_{job_id}",
+                filtered_df[column_name],
+                queries,
+                row_to_query
+            )
+
+        # Checkpointed job state: resuming an interrupted run skips completed
+        # queries and redoes in-flight ones
+        if jobs is not None:
+            todo = jobs.start(job_id, query_template, column_name, queries, retry_failed, cache_ttl)
+            for index, result in jobs.iter_results(job_id):
+                deliver(index, result)
+            if len(todo) < len(values):
+                logger.info(f"Resuming job {job_id}: {len(todo)}/{len(values)} queries left to fetch")
+        else:
+            todo = list(range(len(values)))
+
+        if reused:
+            indexes: Dict[str, List[int]] = {}
+            for index, query_key in reused.items():
+                if not found[index]:
+                    indexes.setdefault(query_key, []).append(index)
+            for query_key, result in store.iter_results(indexes):
+                for index in indexes[query_key]:
+                    deliver(index, result)
+                    if jobs is not None:
+                        jobs.mark_done(job_id, index, result)
+            todo = [index for index in todo if not found[index]]
+            logger.info(
+                f"{sum(index in reused for index in row_to_query)}/{len(row_to_query)} rows are unchanged "
+                f"since an earlier run, fetching {len(todo)} queries for the rest"
+            )
+
+        # Results are filled in by index, so input order holds in both modes
+        if use_async:
+            asyncio.run(search_all_async(todo))
+        else:
+            for done, index in enumerate(todo, start=len(values) - len(todo) + 1):
+                search_serp(index)
+                progress_callback(done, len(values))
+
+        if jobs is not None:
+            jobs.finish(job_id)
+        if export is not None:
+            export_files.append(export.close())
+            export = None
+    finally:
+        # Checkpoint whatever finished, even when the run is interrupted
+        if jobs is not None:
+            jobs.close()
+        if store is not None:
+            store.record(unrecorded)
+            store.close()
+        if export is not None:
+            export.abort()
+
+    results = fan_out(distinct_results, row_to_query) if distinct_results is not None else None
+    logger.info(f"Fetched {sum(found)}/{len(values)} distinct queries for {len(row_to_query)} rows")
+
+    if isinstance(client, ProviderPool) and len(client.entries) > 1:
+        for entry in client.stats():
+            logger.info(f"{entry['name']}: {entry['served']} queries served, healthy: {entry['healthy']}")
+
+    cache_stats = {}
+    if cache is not None:
+        cache_stats = cache.stats()
+        logger.info(f"SERP cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        cache.close()
 
-            
\ No newline at end of file
+    return {
+        "results": results,
+        "export_files": export_files,
+        "cache_stats": cache_stats,
+        "distinct_queries": len(values),
+        "reused_rows": sum(index in reused for index in row_to_query),
+        "job_id": job_id
+    }
@@ -1,40 +1,206 @@
-import psycopg2
+from psycopg2.extras import Json, execute_values
+import argparse
 import json
+from itertools import islice
+from typing import Any, Iterable, List, Tuple
+from components.db import get_connection
+from components.metrics import DB_BATCH_SECONDS, DB_ROWS
 
-# Connect to PostgreSQL
-connection = psycopg2.connect(
-    dbname="my_database",
-    user="your_username",
-    password="your_password",
-    host="localhost"
-)
-cursor = connection.cursor()
-
-# Example JSON response from API
-api_response = {
-    "company": "Tesla",
-    "results": {
-        "snippet": "contact@tesla.com",
-        "link": "https://www.tesla.com"
-    }
-}
+def ensure_schema(connection):
+    """
+    Create filtered_db and the indexes the ingestion and extraction steps rely on.
+
+    search_results is stored as JSONB, company_name is unique so re-ingesting
+    a company updates its row, and a partial index covers the rows still
+    waiting for extraction.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS filtered_db (
+        id SERIAL PRIMARY KEY,
+        company_name TEXT NOT NULL,
+        search_results JSONB,
+        extracted_data TEXT,
+        resolved_by TEXT
+    )
+    """)
+    cursor.execute("ALTER TABLE filtered_db ADD COLUMN IF NOT EXISTS resolved_by TEXT")
+
+    # Extraction workers lease the rows they claim; a lease that expires
+    # without a result belongs to a crashed worker and is claimed again
+    cursor.execute("ALTER TABLE filtered_db ADD COLUMN IF NOT EXISTS lease_owner TEXT")
+    cursor.execute("ALTER TABLE filtered_db ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ")
+    cursor.execute("ALTER TABLE filtered_db ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0")
+
+    # Tables created before JSONB stored search_results as json.dumps text
+    cursor.execute("""
+    SELECT data_type FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'filtered_db' AND column_name = 'search_results'
+    """)
+    if cursor.fetchone()[0] != "jsonb":
+        cursor.execute(
+            "ALTER TABLE filtered_db ALTER COLUMN search_results TYPE JSONB USING search_results::jsonb"
+        )
+
+    # Earlier runs inserted the same company repeatedly. Which copy to keep
+    # is the operator's call, so the unique index waits for dedupe_companies.
+    cursor.execute("SELECT to_regclass('filtered_db_company_name_key')")
+    if cursor.fetchone()[0] is None:
+        cursor.execute("SELECT 1 FROM filtered_db GROUP BY company_name HAVING count(*) > 1 LIMIT 1")
+        if cursor.fetchone() is not None:
+            connection.rollback()
+            cursor.close()
+            raise RuntimeError(
+                "filtered_db holds several rows for some companies. Run "
+                "'python -m components.storeresults --dedupe' once to keep one row per company."
+            )
+        cursor.execute(
+            "CREATE UNIQUE INDEX filtered_db_company_name_key ON filtered_db (company_name)"
+        )
+
+    # Keeps "WHERE extracted_data IS NULL" in llm.py an index scan
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS filtered_db_pending_idx
+    ON filtered_db (id) WHERE extracted_data IS NULL
+    """)
+    connection.commit()
+    cursor.close()
 
-# Insert JSON data into PostgreSQL
-insert_query = """
+def dedupe_companies(connection) -> int:
+    """
+    One-off migration for tables from before company_name was unique: keep
+    one row per company and commit. An extracted row wins over the others,
+    then the newest one.
+
+    Returns:
+        Number of rows deleted
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+    DELETE FROM filtered_db WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY company_name
+                ORDER BY extracted_data IS NOT NULL DESC, id DESC
+            ) AS copy
+            FROM filtered_db
+        ) copies
+        WHERE copy > 1
+    )
+    """)
+    deleted = cursor.rowcount
+    connection.commit()
+    cursor.close()
+    return deleted
+
+UPSERT_QUERY = """
 INSERT INTO filtered_db (company_name, search_results)
-VALUES (%s, %s)
+VALUES %s
+ON CONFLICT (company_name) DO UPDATE
+SET search_results = EXCLUDED.search_results,
+    extracted_data = CASE
+        WHEN filtered_db.search_results IS DISTINCT FROM EXCLUDED.search_results THEN NULL
+        ELSE filtered_db.extracted_data
+    END,
+    resolved_by = CASE
+        WHEN filtered_db.search_results IS DISTINCT FROM EXCLUDED.search_results THEN NULL
+        ELSE filtered_db.resolved_by
+    END,
+    attempts = CASE
+        WHEN filtered_db.search_results IS DISTINCT FROM EXCLUDED.search_results THEN 0
+        ELSE filtered_db.attempts
+    END,
+    lease_owner = CASE
+        WHEN filtered_db.search_results IS DISTINCT FROM EXCLUDED.search_results THEN NULL
+        ELSE filtered_db.lease_owner
+    END
+RETURNING id, company_name, extracted_data
 """
-cursor.execute(insert_query, (api_response["company"], json.dumps(api_response["results"])))
-connection.commit()
-
-# Retrieve data row-wise for LLM processing
-cursor.execute("SELECT company_name, search_results FROM filtered_db")
-rows = cursor.fetchall()
-for row in rows:
-    company_name, search_results = row
-    # Pass search_results to the LLM
-    print(company_name, search_results)
-
-# Close the connection
-cursor.close()
-connection.close()
+
+def upsert_search_results(connection, results: List[Tuple[str, Any]]) -> List[Tuple]:
+    """
+    Upsert one page of (company, search_results) pairs and commit.
+
+    Returns:
+        (id, company_name, extracted_data) for every company written;
+        extracted_data is only set when the results were unchanged. Changed
+        results also reset the row's attempts and drop its lease, so a
+        worker still extracting the old results cannot write them back.
+    """
+    # One statement cannot upsert the same company twice, the last one wins
+    latest = {company: search_results for company, search_results in results}
+    with DB_BATCH_SECONDS.time(operation="upsert"):
+        cursor = connection.cursor()
+        rows = execute_values(
+            cursor,
+            UPSERT_QUERY,
+            [(company, Json(search_results)) for company, search_results in latest.items()],
+            page_size=max(len(latest), 1),
+            fetch=True
+        )
+        connection.commit()
+        cursor.close()
+    DB_ROWS.inc(len(rows), operation="upsert")
+    return rows
+
+def ingest_search_results(
+    connection,
+    results: Iterable[Tuple[str, Any]],
+    page_size: int = 1000
+) -> int:
+    """
+    Bulk upsert (company, search_results) pairs into filtered_db.
+
+    Rows are written page_size at a time with execute_values and committed per
+    page, so the iterator is never materialized. A company that is ingested
+    again gets its results replaced, and its extracted data is cleared only
+    when the results actually changed.
+
+    Returns:
+        Number of rows written
+    """
+    results = iter(results)
+    written = 0
+
+    while True:
+        page = list(islice(results, page_size))
+        if not page:
+            break
+        written += len(upsert_search_results(connection, page))
+
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store search results in filtered_db")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Keep one row per company in a table from before company_name was unique")
+    args = parser.parse_args()
+
+    if args.dedupe:
+        with get_connection() as connection:
+            print(f"Deleted {dedupe_companies(connection)} duplicate company rows")
+            ensure_schema(connection)
+        raise SystemExit
+
+    # Example JSON response from API
+    api_response = {
+        "company": "Tesla",
+        "results": {
+            "snippet": "contact@tesla.com",
+            "link": "https://www.tesla.com"
+        }
+    }
+
+    with get_connection() as connection:
+        ensure_schema(connection)
+
+        # Insert JSON data into PostgreSQL
+        ingest_search_results(connection, [(api_response["company"], api_response["results"])])
+
+        # Retrieve data row-wise for LLM processing
+        cursor = connection.cursor()
+        cursor.execute("SELECT company_name, search_results FROM filtered_db")
+        for company_name, search_results in cursor:
+            # Pass search_results to the LLM
+            print(company_name, json.dumps(search_results))
+        cursor.close()
@@ -1,19 +1,68 @@
 import pandas as pd
 import streamlit as st
-import time
-import numpy as np
 
+from components.background import JobHandle, get_job_runner
 
-def stream_data(data):
-    for word in data.split(" "):
-        yield word + " "
-        time.sleep(0.02)
 
-    yield pd.DataFrame(
-        np.random.randn(5, 10),
-        columns=["a", "b", "c", "d", "e", "f", "g", "h", "i", "j"],
-    )
+def show_latest_rows(handle: JobHandle, limit: int = 1000):
+    """
+    One table of the job's last limit completed rows and the total so far,
+    so a redraw costs the same however many rows the job has produced
+    """
+    count = handle.row_count
+    rows = handle.rows(max(count - limit, 0))
+    st.dataframe(pd.DataFrame(rows), use_container_width=True)
+    st.caption(f"Showing the latest {len(rows)} of {count} rows")
 
-    for word in data.split(" "):
-        yield word + " "
-        time.sleep(0.02)
+
+def show_rows_paginated(handle: JobHandle, key: str, page_size: int = 1000):
+    """
+    One page of the job's rows at a time, copied straight from the handle
+    """
+    count = handle.row_count
+    pages = max((count - 1) // page_size + 1, 1)
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    start = (page - 1) * page_size
+    st.dataframe(pd.DataFrame(handle.rows(start, start + page_size)), use_container_width=True)
+    st.caption(f"Rows {min(start + 1, count)}–{min(start + page_size, count)} of {count}")
+
+
+def show_search_errors(handle: JobHandle):
+    """
+    The queries the job could not search so far, collapsed under one warning
+    """
+    if not handle.error_count:
+        return
+    with st.expander(f"{handle.error_count} queries could not be searched"):
+        for message in handle.errors:
+            st.text(message)
+        if handle.error_count > len(handle.errors):
+            st.caption(f"and {handle.error_count - len(handle.errors)} more, see scraping.log")
+
+
+# Reruns alone, so polling neither blocks the page nor restarts the job
+@st.fragment(run_every="1s")
+def follow_job(job_id: str, limit: int = 1000):
+    """
+    Show a running job's progress and its latest rows, redrawn in place on
+    every tick. Reruns the whole page once the job has finished.
+    """
+    handle = get_job_runner().get(job_id)
+    if handle is None:
+        return
+
+    # Check for completion before reading rows, so the final redraw
+    # includes rows added right before the job finished
+    finished = not handle.running
+    if handle.total:
+        st.progress(
+            handle.searched / handle.total,
+            text=f"Searched {handle.searched}/{handle.total}, extracted {handle.row_count}"
+        )
+    show_latest_rows(handle, limit)
+    show_search_errors(handle)
+
+    if finished:
+        st.rerun()
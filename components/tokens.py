@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken downloads its BPE files on first use, which fails offline
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Count prompt tokens with the model's own tokenizer, falling back to
+    roughly four characters per token when the tokenizer cannot be loaded
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
@@ -0,0 +1,317 @@
+"""
+Extraction worker: claims pending filtered_db rows in batches and extracts them.
+
+Any number of workers, on one machine or many, can run against the same
+database. A batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so
+concurrent workers never receive the same rows, and every claimed row is
+leased to its worker until lease_expires_at. A running worker keeps its
+leases alive; the leases of a worker that crashed expire and their rows are
+claimed again by the others. A row is given up after max_attempts claims
+without a result.
+
+The OpenAI requests and tokens per minute (OPENAI_RPM / OPENAI_TPM) are
+split between the processes started here; when running on several
+machines, set them to each machine's share.
+
+    python -m components.worker --processes 4 --follow
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from components.cache import ResponseCache
+from components.db import get_connection
+from components.llm import (
+    OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE, RESULT_TOKEN_BUDGET, extract_records
+)
+from components.metrics import DB_BATCH_SECONDS, DB_ROWS, setup_logging
+from components.storeresults import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+CLAIM_QUERY = """
+UPDATE filtered_db AS f
+SET lease_owner = %(owner)s,
+    lease_expires_at = now() + make_interval(secs => %(lease_seconds)s),
+    attempts = f.attempts + 1
+FROM (
+    SELECT id, lease_owner FROM filtered_db
+    WHERE extracted_data IS NULL
+      AND attempts < %(max_attempts)s
+      AND (lease_expires_at IS NULL OR lease_expires_at < now())
+    ORDER BY id
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+) AS claimed
+WHERE f.id = claimed.id
+RETURNING f.id, f.company_name, f.search_results, claimed.lease_owner
+"""
+
+# Rows that lost their lease meanwhile (expired and reclaimed, or new search
+# results were ingested) are skipped, their current owner writes them
+COMPLETE_QUERY = """
+UPDATE filtered_db AS f
+SET extracted_data = v.extracted_data, resolved_by = v.resolved_by,
+    lease_owner = NULL, lease_expires_at = NULL
+FROM (VALUES %s) AS v (id, extracted_data, resolved_by, owner)
+WHERE f.id = v.id AND f.lease_owner = v.owner
+"""
+
+RENEW_QUERY = """
+UPDATE filtered_db
+SET lease_expires_at = now() + make_interval(secs => %s)
+WHERE lease_owner = %s AND extracted_data IS NULL
+"""
+
+RELEASE_QUERY = """
+UPDATE filtered_db
+SET lease_owner = NULL, lease_expires_at = NULL
+WHERE lease_owner = %s AND extracted_data IS NULL
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def claim_batch(
+    connection,
+    owner: str,
+    limit: int,
+    lease_seconds: float,
+    max_attempts: int = 3
+) -> Tuple[List[Tuple], int]:
+    """
+    Lease up to limit pending rows to owner and commit.
+
+    Returns:
+        (id, company_name, search_results) rows claimed, and how many of them
+        were reclaimed from an expired lease
+    """
+    with DB_BATCH_SECONDS.time(operation="claim"):
+        cursor = connection.cursor()
+        cursor.execute(CLAIM_QUERY, {
+            "owner": owner,
+            "lease_seconds": lease_seconds,
+            "max_attempts": max_attempts,
+            "limit": limit
+        })
+        claimed = cursor.fetchall()
+        connection.commit()
+        cursor.close()
+    DB_ROWS.inc(len(claimed), operation="claim")
+    rows = [(record_id, company_name, search_results) for record_id, company_name, search_results, _ in claimed]
+    reclaimed = sum(previous_owner is not None for *_, previous_owner in claimed)
+    return rows, reclaimed
+
+
+def complete_batch(connection, owner: str, results: List[Tuple]) -> int:
+    """
+    Write (record_id, extracted_data, resolved_by) rows still leased to owner,
+    release their leases and commit. Rows without a result are released
+    with extracted_data left NULL, to be claimed again.
+
+    Returns:
+        Number of rows written
+    """
+    if not results:
+        return 0
+    with DB_BATCH_SECONDS.time(operation="update"):
+        cursor = connection.cursor()
+        execute_values(
+            cursor,
+            COMPLETE_QUERY,
+            [(record_id, extracted_data, resolved_by, owner) for record_id, extracted_data, resolved_by in results],
+            page_size=len(results)
+        )
+        written = cursor.rowcount
+        connection.commit()
+        cursor.close()
+    DB_ROWS.inc(written, operation="update")
+    return written
+
+
+def _execute(query: str, params: Tuple) -> int:
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        count = cursor.rowcount
+        connection.commit()
+        cursor.close()
+    return count
+
+
+class LeaseKeeper:
+    """
+    Renews the owner's leases every lease_seconds / 3 on its own connection
+    while a batch is being extracted
+    """
+    def __init__(self, owner: str, lease_seconds: float):
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                _execute(RENEW_QUERY, (self.lease_seconds, self.owner))
+            except Exception as e:
+                # The next renewal may succeed before the lease runs out
+                logger.warning(f"Could not renew leases of {self.owner}: {e}")
+
+    def __enter__(self) -> "LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(
+    worker_id: Optional[str] = None,
+    claim_size: int = 100,
+    lease_seconds: float = 60.0,
+    max_attempts: int = 3,
+    follow: bool = False,
+    poll_interval: float = 5.0,
+    batch_size: int = 1,
+    max_prompt_tokens: int = 12000,
+    max_result_tokens: int = RESULT_TOKEN_BUDGET,
+    fast_path_field: Optional[str] = "email",
+    cache_db: Optional[str] = "llm_cache.db",
+    max_concurrency: int = 50,
+    stop: Optional[threading.Event] = None
+) -> Dict[str, int]:
+    """
+    Claim and extract batches of claim_size rows until none are left, or with
+    follow, until stop is set, polling every poll_interval seconds while idle.
+    The extraction options are those of process_and_store_extracted_data.
+
+    Returns:
+        Counts of claimed, reclaimed, extracted and written rows
+    """
+    owner = worker_id or default_worker_id()
+    stop = stop or threading.Event()
+    stats = {"claimed": 0, "reclaimed": 0, "extracted": 0, "written": 0}
+
+    cache = None
+    if cache_db:
+        cache = ResponseCache(cache_db, table="llm_cache", ttl=None)
+
+    logger.info(f"Worker {owner} started")
+    try:
+        while not stop.is_set():
+            with get_connection() as connection:
+                rows, reclaimed = claim_batch(connection, owner, claim_size, lease_seconds, max_attempts)
+            if not rows:
+                if not follow:
+                    break
+                stop.wait(poll_interval)
+                continue
+
+            stats["claimed"] += len(rows)
+            stats["reclaimed"] += reclaimed
+            if reclaimed:
+                logger.info(f"Worker {owner} reclaimed {reclaimed} rows from expired leases")
+
+            # The database connection goes back to the pool while the LLM works
+            with LeaseKeeper(owner, lease_seconds):
+                extracted = extract_records(
+                    rows, batch_size, max_prompt_tokens, max_result_tokens,
+                    fast_path_field, cache, max_concurrency
+                )
+
+            results = [(record_id, *extracted.get(record_id, (None, None))) for record_id, _, _ in rows]
+            stats["extracted"] += sum(extracted_data is not None for _, extracted_data, _ in results)
+            with get_connection() as connection:
+                written = complete_batch(connection, owner, results)
+            stats["written"] += written
+            if written < len(rows):
+                logger.warning(f"Worker {owner} lost the lease on {len(rows) - written} rows")
+    finally:
+        # Hand back anything still leased, e.g. after an error, instead of
+        # making the other workers wait for the lease to expire
+        try:
+            _execute(RELEASE_QUERY, (owner,))
+        except Exception as e:
+            logger.warning(f"Could not release leases of {owner}: {e}")
+        if cache is not None:
+            cache.close()
+
+    logger.info(
+        f"Worker {owner} stopped: {stats['claimed']} claimed ({stats['reclaimed']} reclaimed), "
+        f"{stats['extracted']} extracted, {stats['written']} written"
+    )
+    return stats
+
+
+def _worker_process(options: Dict):
+    setup_logging()
+    stop = threading.Event()
+    # Finish the current batch on Ctrl-C or SIGTERM instead of abandoning its leases
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    run_worker(stop=stop, **options)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Extract pending filtered_db rows, alongside any other workers")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to start on this machine")
+    parser.add_argument("--claim-size", type=int, default=100, help="Rows claimed per batch")
+    parser.add_argument("--lease-seconds", type=float, default=60.0,
+                        help="Lease on claimed rows; a crashed worker's rows are reclaimed after this long")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Claims per row before it is given up")
+    parser.add_argument("--follow", action="store_true", help="Keep polling for new rows instead of exiting when idle")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between polls with --follow")
+    parser.add_argument("--batch-size", type=int, default=1, help="Companies per LLM request")
+    parser.add_argument("--max-concurrency", type=int, default=50, help="LLM requests in flight per process")
+    parser.add_argument("--cache-db", default="llm_cache.db", help="SQLite LLM answer cache, '' to disable")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    with get_connection() as connection:
+        ensure_schema(connection)
+
+    options = {
+        "claim_size": args.claim_size,
+        "lease_seconds": args.lease_seconds,
+        "max_attempts": args.max_attempts,
+        "follow": args.follow,
+        "poll_interval": args.poll_interval,
+        "batch_size": args.batch_size,
+        "max_concurrency": args.max_concurrency,
+        "cache_db": args.cache_db or None
+    }
+    if args.processes == 1:
+        return _worker_process(options)
+
+    # Each process paces itself, so split the account's OpenAI limits between them
+    os.environ["OPENAI_RPM"] = str(max(OPENAI_REQUESTS_PER_MINUTE // args.processes, 1))
+    os.environ["OPENAI_TPM"] = str(max(OPENAI_TOKENS_PER_MINUTE // args.processes, 1))
+
+    # spawn, so no child inherits the parent's pooled connections
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_worker_process, args=(options,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The children got the same SIGINT and are finishing their batches
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
-import time
+import os
 import streamlit as st
 from components.sidebar import sidebar
+from components.metrics import metrics_panel, setup_logging
 import pandas as pd
-from components.streamresults import stream_data
+from components.streamresults import follow_job, show_rows_paginated, show_search_errors
+from components.dataloading import (
+    count_distinct_queries, count_distinct_values, file_digest, load_columns, load_preview, read_columns,
+    show_paginated
+)
+from components.background import get_job_runner, run_fetch_job
+from components.jobs import job_id_for
+from components.queryplan import plan_rendered_queries, render_queries, template_columns
 
 st.set_page_config(page_title="Fetchify", page_icon="🔎", layout="wide")
+setup_logging()
 st.header("Fetchify 🔎")
 
 sidebar()
+metrics_panel()
 
 openai_api_key = st.session_state.get("OPENAI_API_KEY")
 if not openai_api_key:
@@ -17,59 +27,117 @@ if not openai_api_key:
     )
 
 
-
-
-def long_running_function():
-    time.sleep(5)  # Simulate a delay
-    # Example result: could be replaced with actual data processing results
-    result_data = pd.DataFrame({
-        "Entity": ["Company A", "Company B", "Company C"],
-        "Email": ["a@example.com", "b@example.com", "c@example.com"],
-    })
-    return result_data
-
-
-
-
+def show_job(job_id):
+    handle = get_job_runner().get(job_id)
+    if handle is None:
+        st.info("This job is no longer running on the server. Start it again to resume it.")
+        return
+
+    # While the job runs, the fragment redraws its latest rows every second;
+    # a finished job is browsed page by page
+    st.write("Here are your results:")
+    if handle.running:
+        follow_job(job_id)
+        return
+    show_rows_paginated(handle, key=f"results:{job_id}")
+    show_search_errors(handle)
+
+    if handle.status == "failed":
+        st.error(f"The job failed: {handle.error}")
+    elif handle.status == "done":
+        st.success("Results fetched successfully!")
+        if handle.reused_rows:
+            st.caption(f"{handle.reused_rows} rows were unchanged since an earlier run and reused its results")
+        for path in handle.export_files:
+            with open(path, "rb") as export_file:
+                st.download_button(
+                    f"Download {os.path.basename(path)}",
+                    export_file,
+                    file_name=os.path.basename(path),
+                    key=f"download:{path}"
+                )
 
 
 uploaded_file = st.file_uploader("Upload a CSV file", accept_multiple_files=False)
 if uploaded_file is not None:
     try:
-        # Attempt to load and display the CSV file
-        df = pd.read_csv(uploaded_file)
+        # Parse lazily: header and a preview first, then only the chosen column,
+        # all cached by the file's contents so reruns skip the parse
+        digest = file_digest(uploaded_file)
+        columns = read_columns(digest, uploaded_file)
         st.write("### Full Dataset")
         
-        # Display the dataframe
-        st.dataframe(df, use_container_width=True, height=400)
+        # Display the first rows rather than sending the whole file to the browser
+        preview = load_preview(digest, uploaded_file)
+        st.dataframe(preview, use_container_width=True, height=400)
+        st.caption(f"Showing the first {len(preview)} rows")
         
         # Selecting column for filtering
-        columns = df.columns.tolist()
         selected_column = st.selectbox("Select column to filter by", columns)
+        df = load_columns(digest, (selected_column,), uploaded_file)
         
         # Displaying unique entries from the selected column
         filtered_df = df[selected_column]
-        unique_values = df[selected_column].unique()
-        st.write("Filtered Column:", filtered_df)
+        unique_values = count_distinct_values(digest, selected_column, filtered_df)
+        st.write("Filtered Column:")
+        show_paginated(filtered_df, key=f"page:{digest}:{selected_column}")
+        st.caption(
+            f"{unique_values} distinct values out of {len(filtered_df)} rows "
+            "(case and whitespace are ignored, empty cells are not counted)"
+        )
         
-        st.text_input(
+        query_template = st.text_input(
             "Input your search query for each entry in the column, using placeholders :  ",
             "Eg : ",
-            key="query"
+            key="query",
+            help="{value} is the selected column; other columns can be used by name, e.g. '{company} {city} contact email'."
+        )
+        missing_policies = {
+            "skip": "Skip the row",
+            "empty": "Search without the missing value",
+            "error": "Stop and show the rows"
+        }
+        missing_values = st.selectbox(
+            "When a placeholder column is empty",
+            list(missing_policies),
+            format_func=missing_policies.get
         )
+        export_format = st.selectbox("Export format", ["excel", "csv", "jsonl", "parquet"])
+
+        try:
+            placeholders = template_columns(columns, query_template, selected_column)
+            # Load only the columns the template needs, cached like the selected one
+            needed = tuple(dict.fromkeys([selected_column, *placeholders.values()]))
+            job_df = load_columns(digest, needed, uploaded_file)
+            searches = count_distinct_queries(digest, query_template, selected_column, missing_values, job_df)
+        except ValueError:
+            # Not a usable template yet; the Start button reports why
+            pass
+        else:
+            st.caption(f"{searches} distinct queries out of {len(job_df)} rows will be searched")
 
         if st.button("Start Fetching Data"):
-            with st.spinner("Fetching data, please wait..."):
-             # Run the long-running function and store results
-                results = long_running_function()
-
-            st.success("Results fetched successfully!")
-
-    
-            if st.button("Show Results"):
-                # Display the results
-                st.write("Here are your results:")
-                st.stream_data(results)
+            try:
+                placeholders = template_columns(columns, query_template, selected_column)
+                # Load only the columns the template needs, cached like the selected one
+                needed = tuple(dict.fromkeys([selected_column, *placeholders.values()]))
+                job_df = load_columns(digest, needed, uploaded_file)
+                rendered = render_queries(job_df, query_template, selected_column, missing_values)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                # Runs on the shared background executor; the same sheet and query map to the same job,
+                # and starting it again retries the queries that failed last time
+                first_rows, _ = plan_rendered_queries(rendered)
+                job_id = job_id_for(query_template, rendered.take(first_rows).tolist())
+                get_job_runner().submit(
+                    job_id, run_fetch_job, query_template, selected_column, job_df, openai_api_key,
+                    export_format=export_format, missing_values=missing_values, retry_failed=True
+                )
+                st.session_state["job_id"] = job_id
+
+        if st.session_state.get("job_id"):
+            show_job(st.session_state["job_id"])
 
         st.button("Rerun")
 
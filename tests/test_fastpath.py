@@ -0,0 +1,68 @@
+import pytest
+
+from components.fastpath import domain_matches_entity, resolve_fast_path
+
+
+@pytest.mark.parametrize("domain, entity", [
+    ("tesla.com", "Tesla Inc"),
+    ("fordmotor.com", "Ford Motor Company"),
+    ("ford-motor.co.uk", "Ford Motor Company"),
+    ("ford-motor-europe.com", "Ford Motor Company"),
+    ("tesla-energy.com", "Tesla"),
+    ("mail.acme.io", "Acme"),
+])
+def test_domain_matches_entity(domain, entity):
+    assert domain_matches_entity(domain, entity)
+
+
+@pytest.mark.parametrize("domain, entity", [
+    ("facebook.com", "Ace Hardware"),
+    ("artificialintelligence.com", "Intel"),
+    ("intelligence.com", "Intel"),
+    ("pineapple.com", "Apple Inc"),
+    ("acehardware-reviews.com", "Ace"),
+    ("example.com", "Inc"),
+    ("united-bank.com", "United Airlines"),
+    ("general-assembly.org", "General Electric"),
+    ("american-express.com", "American Airlines"),
+])
+def test_domain_does_not_match_entity(domain, entity):
+    assert not domain_matches_entity(domain, entity)
+
+
+@pytest.mark.parametrize("entity, snippet", [
+    ("Ace Hardware", "Reach us at support@facebook.com"),
+    ("Intel", "Write to editor@artificialintelligence.com"),
+    ("Apple Inc", "Orders: hello@pineapple.com"),
+    ("United Airlines", "Banking help: info@united-bank.com"),
+    ("General Electric", "Press: press@general-assembly.org"),
+    ("American Airlines", "Card support: support@american-express.com"),
+])
+def test_unrelated_email_goes_to_llm(entity, snippet):
+    results = {"organic_results": [{"snippet": snippet}]}
+    assert resolve_fast_path(entity, results) is None
+
+
+def test_single_matching_email_is_resolved():
+    results = {"organic_results": [
+        {"snippet": "Contact press@tesla.com for media enquiries"},
+        {"snippet": "Fan club: hello@teslafans.org"},
+    ]}
+    assert resolve_fast_path("Tesla Inc", results) == "press@tesla.com"
+
+
+def test_phone_from_unrelated_result_goes_to_llm():
+    results = {"organic_results": [
+        {"link": "https://www.yelp.com/biz/acme-plumbing", "snippet": "Yelp support: (800) 555-0199"},
+    ]}
+    assert resolve_fast_path("Acme Plumbing", results, field="phone") is None
+
+
+def test_phone_from_entity_knowledge_graph_is_resolved():
+    results = {
+        "knowledge_graph": {"title": "Acme Plumbing", "website": "https://acmeplumbing.com", "phone": "(312) 555-0142"},
+        "organic_results": [
+            {"link": "https://www.yelp.com/biz/acme-plumbing", "snippet": "Yelp support: (800) 555-0199"},
+        ],
+    }
+    assert resolve_fast_path("Acme Plumbing", results, field="phone") == "(312) 555-0142"
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from components import ratelimiting
+from components.ratelimiting import RateLimiter, get_rate_limiter
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimiting, "time", clock)
+    monkeypatch.setattr(ratelimiting, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_up_to_the_limit_then_refill(clock):
+    limiter = RateLimiter(max_per_second=2, max_per_day=None)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert limiter.time_until_available() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_every_window_must_have_budget(clock):
+    limiter = RateLimiter(max_per_second=10, max_per_day=3)
+    for _ in range(3):
+        assert limiter.try_acquire()
+        clock.now += 1
+    assert not limiter.try_acquire()
+    # Each request takes a third of the day to refill
+    assert limiter.time_until_available() == pytest.approx(86400 / 3 - 3)
+
+
+def test_cost_above_a_window_limit_is_rejected(clock):
+    limiter = RateLimiter(max_per_second=None, max_per_day=None, max_per_minute=100)
+    assert limiter.try_acquire(cost=100)
+    with pytest.raises(ValueError):
+        limiter.try_acquire(cost=101)
+
+
+def test_wait_if_needed_sleeps_until_allowed(clock):
+    limiter = RateLimiter(max_per_second=1, max_per_day=None)
+    limiter.wait_if_needed()
+    limiter.wait_if_needed()
+    assert clock.slept == [pytest.approx(1.0)]
+
+
+def test_penalize_blocks_without_spending_budget(clock):
+    limiter = RateLimiter(max_per_second=2, max_per_day=None)
+    limiter.penalize(10)
+    assert limiter.time_until_available() == pytest.approx(10)
+    assert not limiter.try_acquire()
+
+    clock.now += 10
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+
+
+def test_budget_and_penalty_survive_a_restart(clock, tmp_path):
+    state_path = str(tmp_path / "limits.json")
+    limiter = RateLimiter(max_per_second=None, max_per_day=2, state_path=state_path)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    limiter.penalize(30)
+
+    restored = RateLimiter(max_per_second=None, max_per_day=2, state_path=state_path)
+    assert not restored.try_acquire()
+    assert restored.time_until_available() == pytest.approx(43200)
+    assert restored._blocked_until == pytest.approx(clock.now + 30)
+    # No temporary files are left next to the state file
+    assert os.listdir(tmp_path) == ["limits.json"]
+
+
+def test_unreadable_state_starts_with_a_full_budget(clock, tmp_path):
+    state_path = tmp_path / "limits.json"
+    state_path.write_text("{not json")
+    limiter = RateLimiter(max_per_second=None, max_per_day=1, state_path=str(state_path))
+    assert limiter.try_acquire()
+
+
+def test_one_limiter_per_state_file(clock, tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimiting, "_limiters", {})
+    monkeypatch.chdir(tmp_path)
+    shared = get_rate_limiter("limits.json", max_per_second=None, max_per_day=1)
+    assert get_rate_limiter(str(tmp_path / "limits.json"), max_per_day=50) is shared
+    assert get_rate_limiter("other.json", max_per_second=None, max_per_day=1) is not shared
+
+    assert shared.try_acquire()
+    assert not get_rate_limiter("limits.json").try_acquire()
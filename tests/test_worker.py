@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from components.storeresults import ensure_schema
+from components.worker import claim_batch, complete_batch
+
+# A scratch database; its filtered_db is emptied by every test
+DSN = os.getenv("FETCHIFY_TEST_PG_DSN")
+
+pytestmark = pytest.mark.skipif(not DSN, reason="FETCHIFY_TEST_PG_DSN is not set")
+
+
+@pytest.fixture
+def connect():
+    connections = []
+
+    def connect():
+        connection = psycopg2.connect(DSN)
+        connections.append(connection)
+        return connection
+
+    yield connect
+    for connection in connections:
+        connection.close()
+
+
+@pytest.fixture
+def connection(connect):
+    connection = connect()
+    ensure_schema(connection)
+    cursor = connection.cursor()
+    cursor.execute("TRUNCATE filtered_db RESTART IDENTITY")
+    connection.commit()
+    cursor.close()
+    return connection
+
+
+def insert_rows(connection, count: int):
+    cursor = connection.cursor()
+    cursor.executemany(
+        "INSERT INTO filtered_db (company_name, search_results) VALUES (%s, %s)",
+        [(f"Company {i}", json.dumps({"organic_results": []})) for i in range(count)]
+    )
+    connection.commit()
+    cursor.close()
+
+
+def expire_leases(connection):
+    cursor = connection.cursor()
+    cursor.execute("UPDATE filtered_db SET lease_expires_at = now() - interval '1 second' WHERE lease_owner IS NOT NULL")
+    connection.commit()
+    cursor.close()
+
+
+def test_concurrent_claims_are_disjoint(connection, connect):
+    insert_rows(connection, 200)
+    claimed = {}
+    start = threading.Barrier(2)
+
+    def claim(owner):
+        worker_connection = connect()
+        start.wait()
+        claimed[owner], _ = claim_batch(worker_connection, owner, 150, lease_seconds=60)
+
+    threads = [threading.Thread(target=claim, args=(owner,)) for owner in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids_a = {row[0] for row in claimed["a"]}
+    ids_b = {row[0] for row in claimed["b"]}
+    assert not ids_a & ids_b
+    assert len(ids_a | ids_b) == 200
+
+
+def test_live_lease_is_not_claimed_again(connection):
+    insert_rows(connection, 10)
+    first, _ = claim_batch(connection, "a", 10, lease_seconds=60)
+    second, _ = claim_batch(connection, "b", 10, lease_seconds=60)
+    assert len(first) == 10
+    assert second == []
+
+
+def test_expired_lease_is_reclaimed_and_counted(connection):
+    insert_rows(connection, 5)
+    claim_batch(connection, "crashed", 3, lease_seconds=60)
+    expire_leases(connection)
+
+    rows, reclaimed = claim_batch(connection, "b", 10, lease_seconds=60)
+    assert len(rows) == 5
+    assert reclaimed == 3
+
+
+def test_complete_batch_skips_rows_leased_to_another_worker(connection):
+    insert_rows(connection, 3)
+    rows, _ = claim_batch(connection, "a", 3, lease_seconds=60)
+    lost_id = rows[0][0]
+    cursor = connection.cursor()
+    cursor.execute("UPDATE filtered_db SET lease_owner = 'b' WHERE id = %s", (lost_id,))
+    connection.commit()
+
+    written = complete_batch(connection, "a", [(record_id, "x@example.com", "llm") for record_id, _, _ in rows])
+    assert written == 2
+    cursor.execute("SELECT extracted_data, lease_owner FROM filtered_db WHERE id = %s", (lost_id,))
+    assert cursor.fetchone() == (None, "b")
+    cursor.close()
+
+
+def test_rows_are_given_up_after_max_attempts(connection):
+    insert_rows(connection, 1)
+    for _ in range(2):
+        rows, _ = claim_batch(connection, "a", 1, lease_seconds=60, max_attempts=2)
+        assert len(rows) == 1
+        expire_leases(connection)
+
+    rows, _ = claim_batch(connection, "a", 1, lease_seconds=60, max_attempts=2)
+    assert rows == []